@@ -0,0 +1,71 @@
+# compares BPlusTree orders (and BTree as a baseline) on insert, range and closest lookups
+# run from the repo root: python -m benchmarks.b_plus_tree_orders --songs 114000
+import argparse
+import random
+import time
+
+from src.b_plus_tree import BPlusTree
+from src.b_tree import BTree
+
+ORDERS = [4, 32, 128]
+
+
+def best_time(function, repeat):
+    # best of repeat runs, in seconds
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def build(make_tree, items):
+    tree = make_tree()
+    for key, value in items:
+        tree.insert(key, value)
+    return tree
+
+
+def run_ranges(tree, bands):
+    for low, high in bands:
+        for _ in tree.range(low, high):
+            pass
+
+
+def run_closest(tree, keys):
+    for key in keys:
+        tree.find_closest(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BPlusTree order comparison.")
+    parser.add_argument("--songs", type=int, default=114_000)
+    parser.add_argument("--queries", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    items = [(round(rng.random(), 3), row) for row in range(args.songs)]
+    # narrow bands like a danceability filter, plus the playlist bands
+    bands = [(low, low + 0.01) for low in (rng.random() for _ in range(args.queries))]
+    bands += [(0.7, 1.0), (0.4, 0.6), (0, 0.4)]
+    keys = [rng.random() for _ in range(args.queries)]
+
+    trees = {"BTree order 4": lambda: BTree(order=4)}
+    for order in ORDERS:
+        trees[f"BPlusTree order {order}"] = lambda order=order: BPlusTree(order=order)
+
+    print(f"{args.songs} songs, {len(bands)} ranges, {len(keys)} closest lookups, best of {args.repeat}")
+    print(f"{'tree':<22}{'insert s':>12}{'range s':>12}{'closest s':>12}")
+    for name, make_tree in trees.items():
+        insert_time = best_time(lambda: build(make_tree, items), args.repeat)
+        tree = build(make_tree, items)
+        range_time = best_time(lambda: run_ranges(tree, bands), args.repeat)
+        closest_time = best_time(lambda: run_closest(tree, keys), args.repeat)
+        print(f"{name:<22}{insert_time:>12.4f}{range_time:>12.4f}{closest_time:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
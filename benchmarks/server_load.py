@@ -0,0 +1,76 @@
+# latency of a running query server (server.py) under concurrent clients
+# every client keeps one connection and sends its requests one after another
+# run from the repo root, with the server already started:
+#   python -m benchmarks.server_load --port 8765 --clients 16 --requests 50
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+GENRES = ["pop", "rock", "jazz", "hip-hop", "classical", "edm", "country", "metal"]
+BANDS = [[0.7, 1.0], [0.4, 0.7], [0.0, 0.4], None]
+
+
+def random_request(rng, request_id):
+    kind = rng.choice(["playlist", "playlist", "closest", "similar"])
+    request = {"id": request_id, "type": kind, "structure": rng.choice(["red_black_tree", "b_tree"])}
+    if kind == "playlist":
+        request.update(genres=rng.sample(GENRES, 2), danceability=rng.choice(BANDS), valence=rng.choice(BANDS), max_songs=20)
+    elif kind == "closest":
+        request.update(danceability=round(rng.random(), 3), k=20)
+    else:
+        request.update(danceability=round(rng.random(), 3), valence=round(rng.random(), 3), k=20)
+    return request
+
+
+async def client(args, rng, latencies, errors):
+    if args.unix:
+        reader, writer = await asyncio.open_unix_connection(args.unix)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    for i in range(args.requests):
+        start = time.perf_counter()
+        writer.write((json.dumps(random_request(rng, i)) + "\n").encode())
+        await writer.drain()
+        while True:
+            reply = json.loads(await reader.readline())
+            if "song" not in reply:
+                break
+        if "error" in reply:
+            errors.append(reply["error"])  # failed requests are not latency samples
+        else:
+            latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def run(args):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(args, random.Random(args.seed + i), latencies, errors) for i in range(args.clients)])
+    elapsed = time.perf_counter() - start
+    samples = np.array(latencies)
+    print(f"{len(samples)} requests from {args.clients} clients in {elapsed:.3f} s ({len(samples) / elapsed:.1f} per second)")
+    if errors:
+        print(f"{len(errors)} requests failed, e.g. {errors[0]}")
+    if not len(samples):
+        return
+    print(f"p50 {np.percentile(samples, 50):.6f} s, p90 {np.percentile(samples, 90):.6f} s, p99 {np.percentile(samples, 99):.6f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query server load test.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a unix socket instead of tcp")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# bytes per song held by each tree, measured with tracemalloc
+# run from the repo root: python -m benchmarks.tree_memory --sizes 10000 114000
+import argparse
+import random
+import tracemalloc
+
+from src.b_tree import BTree
+from src.compact_red_black_tree import CompactRedBlackTree
+from src.red_black_tree import RedBlackTree
+
+BUILDERS = {
+    "RedBlackTree": lambda items: RedBlackTree.from_sorted(items),
+    "CompactRedBlackTree": lambda items: CompactRedBlackTree.from_sorted(items),
+    "BTree (order 4)": lambda items: BTree.from_sorted(items, order=4),
+}
+
+
+def song_items(count, seed=0):
+    # (danceability, row id) pairs sorted by key, like main() builds
+    rng = random.Random(seed)
+    return sorted(((round(rng.random(), 3), row) for row in range(count)), key=lambda item: item[0])
+
+
+def measure(builder, items):
+    # memory still held by the tree once it is built, not counting the items
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = builder(items)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory used per song by each tree.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 114_000])
+    args = parser.parse_args()
+
+    print(f"{'tree':<22}{'songs':>10}{'bytes':>14}{'bytes/song':>12}")
+    for size in args.sizes:
+        items = song_items(size)
+        for name, builder in BUILDERS.items():
+            used = measure(builder, items)
+            print(f"{name:<22}{size:>10}{used:>14}{used / size:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# benchmark suite for the tree backends over synthetic song tables of several sizes
+# times build, insert, iteration, find_closest, range, filter and planned
+# queries with perf_counter, after warmup runs, and reports percentiles over
+# the repetitions
+# run from the repo root:
+#   python -m benchmarks.tree_suite --sizes 10000 100000 --output results.json
+#   python -m benchmarks.tree_suite --compare before.json after.json
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+
+import numpy as np
+
+from main import find_matching_songs, songs_in_band
+from src.b_plus_tree import BPlusTree
+from src.b_tree import BTree
+from src.compact_red_black_tree import CompactRedBlackTree
+from src.dataset_utils import SongTable, song_copies
+from src.genre_index import GenreIndex
+from src.query_planner import TableStats
+from src.text_column import TextColumn
+from src.red_black_tree import RedBlackTree
+
+# name -> (build from sorted pairs, empty tree for inserts), new backends go here
+BACKENDS = {
+    "RedBlackTree": (RedBlackTree.from_sorted, RedBlackTree),
+    "BTree": (lambda items: BTree.from_sorted(items, order=4), lambda: BTree(order=4)),
+    "CompactRedBlackTree": (CompactRedBlackTree.from_sorted, CompactRedBlackTree),
+    "BPlusTree": (lambda items: BPlusTree.from_sorted(items, order=32), lambda: BPlusTree(order=32)),
+}
+
+CASES = ["build", "insert", "iterate", "find_closest", "range", "filter", "planned"]
+
+GENRE_COUNT = 114  # as many as the real dataset has
+NAME_COUNT = 5_000  # distinct titles and artists, repeated over the rows
+
+
+def synthetic_table(rows, seed):
+    # song table shaped like the real one, numbers spread the way the csv has them
+    rng = np.random.default_rng(seed)
+    names = [f"Song {i}" for i in range(NAME_COUNT)]
+    artists = [f"Artist {i}" for i in range(NAME_COUNT)]
+    table = SongTable(
+        track_name=TextColumn(rng.integers(0, NAME_COUNT, rows).astype(np.int32), names),
+        artists=TextColumn(rng.integers(0, NAME_COUNT, rows).astype(np.int32), artists),
+        genres=[f"genre {i:03d}" for i in range(GENRE_COUNT)],
+        genre_codes=rng.integers(0, GENRE_COUNT, rows).astype(np.int16),
+        tempo=rng.uniform(60, 200, rows).round(3),
+        popularity=rng.integers(0, 101, rows).astype(np.int16),
+        danceability=rng.beta(5, 3, rows).round(3),
+        valence=rng.uniform(0, 1, rows).round(3),
+        explicit=rng.random(rows) < 0.1,
+    )
+    table.dance_order = np.argsort(table.danceability, kind="stable")
+    table.genre_index = GenreIndex(table)
+    table.set_song_ids(song_copies(table))
+    table.column_stats = TableStats(table)
+    return table
+
+
+def random_filters(rng, genres):
+    # filter dicts like ask_user_questions builds, no max_songs so every match is counted
+    filters = {"max_songs": None, "explicit": rng.choice([None, False])}
+    filters["danceability"] = rng.choice([(0.7, 1.0), (0.4, 0.7), (0.0, 0.4), None])
+    filters["valence"] = rng.choice([(0.7, 1.0), (0.4, 0.7), (0.0, 0.4), None])
+    filters["popularity"] = rng.choice([(70, 100), (40, 70), (0, 40), None])
+    filters["genres"] = rng.sample(genres, rng.randint(1, 6)) if rng.random() < 0.5 else None
+    return filters
+
+
+def tree_filter(tree, filters, table):
+    # every match through the tree's own danceability range and one mask for
+    # the other filters, the planner would often skip the tree and then every
+    # backend would time the same numpy scan
+    rows = songs_in_band(tree, filters)
+    return table.unique_songs(rows[table.filter_mask(filters, rows)])
+
+
+def timed(function, warmup, repeat):
+    # seconds taken by each of repeat runs, after warmup runs that are thrown away
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def timed_queries(run_one, queries, warmup, repeat):
+    # seconds per query, every query timed on its own in each repetition
+    for query in queries[:warmup * 10]:
+        run_one(query)
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            run_one(query)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summary(samples):
+    samples = np.array(samples)
+    return {
+        "samples": len(samples),
+        "mean": float(samples.mean()),
+        "min": float(samples.min()),
+        "p50": float(np.percentile(samples, 50)),
+        "p90": float(np.percentile(samples, 90)),
+        "p99": float(np.percentile(samples, 99)),
+    }
+
+
+def run_backend(name, table, sorted_items, args, rng):
+    from_sorted, empty = BACKENDS[name]
+    rows = len(table)
+    tree = from_sorted(sorted_items)
+    keys = [rng.random() for _ in range(args.queries)]
+    bands = [(low, low + 0.01) for low in keys]
+    lowered = [genre.lower() for genre in table.genres]
+    filters = [random_filters(rng, lowered) for _ in range(args.queries)]
+    results = {}
+
+    do_inserts = "insert" in args.cases and rows <= args.max_insert_rows
+    insert_items = list(zip(table.danceability.tolist(), range(rows))) if do_inserts else []
+
+    def insert_all():
+        fresh = empty()
+        for key, value in insert_items:
+            fresh.insert(key, value)
+
+    def drain(iterator):
+        for _ in iterator:
+            pass
+
+    cases = {
+        "build": lambda: timed(lambda: from_sorted(sorted_items), args.warmup, args.repeat),
+        "insert": lambda: timed(insert_all, min(args.warmup, 1), args.repeat),
+        "iterate": lambda: timed(lambda: drain(iter(tree)), args.warmup, args.repeat),
+        "find_closest": lambda: timed_queries(tree.find_closest, keys, args.warmup, args.repeat),
+        "range": lambda: timed_queries(lambda band: drain(tree.range(*band)), bands, args.warmup, args.repeat),
+        "filter": lambda: timed_queries(lambda query: tree_filter(tree, query, table), filters, args.warmup, args.repeat),
+        "planned": lambda: timed_queries(lambda query: find_matching_songs(tree, query, name, table), filters, args.warmup, args.repeat),
+    }
+    for case in args.cases:
+        if case == "insert" and not do_inserts:
+            continue
+        results[case] = cases[case]()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    # p50 of each case in after relative to before, above 1.0 is slower
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before = {(r["backend"], r["rows"], r["case"]): r for r in json.load(before_file)["results"]}
+        after = json.load(after_file)["results"]
+    print(f"{'backend':<20} {'rows':>9} {'case':<13} {'before p50':>12} {'after p50':>12} {'ratio':>7}")
+    for result in after:
+        old = before.get((result["backend"], result["rows"], result["case"]))
+        if old is None:
+            continue
+        ratio = result["p50"] / old["p50"] if old["p50"] else float('inf')
+        flag = "  slower" if ratio > 1.1 else ""
+        print(f"{result['backend']:<20} {result['rows']:>9} {result['case']:<13} "
+              f"{old['p50']:>12.6f} {result['p50']:>12.6f} {ratio:>7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tree backend benchmark suite.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="table sizes, up to 10_000_000")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--queries", type=int, default=200, help="lookups per query case")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-insert-rows", type=int, default=1_000_000,
+                        help="skip one at a time inserts above this size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results here as json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two json result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "results": [],
+    }
+    print(f"{'backend':<20} {'rows':>9} {'case':<13} {'p50 (s)':>12} {'p90 (s)':>12} {'p99 (s)':>12}")
+    for rows in args.sizes:
+        table = synthetic_table(rows, args.seed)
+        order = table.dance_order
+        sorted_items = list(zip(table.danceability[order].tolist(), order.tolist()))
+        for name in args.backends:
+            # same queries for every backend at this size
+            results = run_backend(name, table, sorted_items, args, random.Random(args.seed))
+            for case, samples in results.items():
+                result = {"backend": name, "rows": rows, "case": case, **summary(samples)}
+                report["results"].append(result)
+                print(f"{name:<20} {rows:>9} {case:<13} {result['p50']:>12.6f} {result['p90']:>12.6f} {result['p99']:>12.6f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
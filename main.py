@@ -1,53 +1,200 @@
+import time
+START_TIME = time.perf_counter()  # taken before the other imports, for the time to the first prompt
+
 from src.red_black_tree import RedBlackTree
 from src.b_tree import BTree
-from src.dataset_utils import load_song_dataset
-import time
+from src.kd_tree import KDTree
+from src.genre_shards import GenreShards
+from src.dataset_utils import load_song_table, apply_song_delta
+from src.similarity import SimilarityIndex
+from src.query_cache import QueryCache, query_key
+from src.query_planner import plan_query
+from src.background_loader import BackgroundLoader
+import numpy as np
+import argparse
+import json
+import multiprocessing
+import os
 import random
 
-# recommend a list of songs based on the answers user enters
-def recommend_songs(tree, filters, structure_name):
-    print(f"\nFinding songs using {structure_name}...")
-
+def songs_in_band(tree, filters):
+    # the trees are keyed on danceability, so only walk the requested band
+    # gives back the row ids of the songs as an array
+    if filters.get("danceability"):
+        low, high = filters["danceability"]
+        rows = tree.range(low, high)
+    else:
+        rows = iter(tree)
+    return np.fromiter(rows, dtype=np.int64)
+
+def access_path(tree):
+    # (name, filters its lookup handles) of a structure's own way in, and
+    # whether that is the only way (genre shards hold no other index)
+    if isinstance(tree, GenreShards):
+        return ("genre shards", {"genres", "danceability"}), True
+    if isinstance(tree, KDTree):
+        return ("k-d tree box", {"danceability", "valence", "popularity", "tempo", "explicit"}), False
+    return ("danceability tree range", {"danceability"}), False
+
+def plan_for(tree, filters, table, sampling=False):
+    # cheapest of the structure's lookup, the genre posting lists and a
+    # scan of the whole table, going by the table's column histograms
+    # with sampling a playlist may also be drawn at random from a tree that
+    # can pick rows by position
+    tree_path, tree_only = access_path(tree)
+    band_rows = None
+    if sampling and hasattr(tree, "sample_range"):
+        low, high = filters.get("danceability") or (float("-inf"), float("inf"))
+        band_rows = tree.count_range(low, high)
+    return plan_query(table.column_stats, filters, tree_path, tree_only, band_rows)
+
+def candidate_rows(tree, filters, table):
+    # row ids that pass every filter, gathered the way the query plan picked,
+    # then the filters left over, most selective first
+    plan = plan_for(tree, filters, table)
+    distinct = getattr(tree, "distinct_songs", False)
+    if plan.access == "scan":
+        mask = table.song_variants()[1] if distinct else ~table.deleted
+        mask = mask & table.filter_mask(residual_filters(filters))
+        if filters.get("genres"):
+            mask &= genre_mask(tree, table, filters["genres"])
+        rows = np.flatnonzero(mask)
+        return rows[np.argsort(table.danceability[rows], kind="stable")]  # same order a tree gives
+
+    if plan.access == "genre postings":
+        rows = table.genre_index.rows_for(filters["genres"])
+        if distinct:
+            rows = np.unique(table.song_variants()[0][rows])
+    elif isinstance(tree, (GenreShards, KDTree)):
+        rows = tree.rows_for(filters)
+    else:
+        rows = songs_in_band(tree, filters)
+    for name, _ in plan.residual:
+        if name == "genres":
+            rows = rows[genre_mask(tree, table, filters["genres"])[rows]]
+        else:
+            rows = rows[table.filter_mask({name: filters[name]}, rows)]
+    return rows
+
+def explain_query(tree, filters, table):
+    # the plan for filters as lines of text, and the plan used when random
+    # draws find too few songs
+    plan = plan_for(tree, filters, table, sampling=True)
+    if plan.access != "random sample":
+        return plan.explain()
+    return plan.explain() + ["if too few pass:"] + plan_for(tree, filters, table).explain()
+
+def genre_mask(tree, table, genres):
+    # mask over all rows of the songs in the genres, a tree holding one row
+    # per song variant matches that row when any copy of the variant (a copy
+    # with the same filtered values) is in the genres
+    if getattr(tree, "distinct_songs", False):
+        return table.genre_index.song_mask_for(genres, table.song_variants()[0])
+    return table.genre_index.mask_for(genres)
+
+def residual_filters(filters):
+    # filters other than the genres, which go through the genre index
+    return {name: value for name, value in filters.items() if name != "genres"}
+
+def passing_mask(tree, filters, table, rows):
+    # mask over rows (an array of row ids) of the ones that pass every filter
+    mask = table.filter_mask(residual_filters(filters), rows)
+    if filters.get("genres"):
+        mask &= genre_mask(tree, table, filters["genres"])[rows]
+    return mask
+
+def first_passing_copies(tree, filters, table, rows):
+    # rows (which all pass the filters) that are the first copy of their song
+    # in the tree to pass them, so a song listed under several genres in the
+    # band is no more likely to be drawn than a song listed once
+    keep = np.ones(len(rows), dtype=bool)
+    for i, (row, copies) in enumerate(zip(rows.tolist(), table.copies_of(rows))):
+        earlier = copies[copies < row]
+        if getattr(tree, "distinct_songs", False):
+            earlier = earlier[table.song_variants()[1][earlier]]
+        if len(earlier):
+            keep[i] = not passing_mask(tree, filters, table, earlier).any()
+    return rows[keep]
+
+def sample_songs(tree, filters, table, draws):
+    # draw random songs from the danceability band and keep the ones that
+    # pass the other filters, until there are max_songs of them
+    # draws is how many the query plan expects it takes, the first round
+    # draws a quarter more than that
+    # gives None when too few pass, then every match is collected instead
+    max_songs = filters["max_songs"]
+    low, high = filters.get("danceability") or (float("-inf"), float("inf"))
+    count = tree.count_range(low, high)
+
+    picked = []
+    seen_songs = set()
+    draw = max(max_songs * 2, int(draws * 1.25))
+    while draw <= count:
+        rows = np.array(tree.sample_range(low, high, draw), dtype=np.int64)
+        rows = first_passing_copies(tree, filters, table, rows[passing_mask(tree, filters, table, rows)])
+        for row, song_id in zip(rows.tolist(), table.song_ids[rows].tolist()):
+            if song_id not in seen_songs:
+                picked.append(row)
+                seen_songs.add(song_id)
+                if len(picked) == max_songs:
+                    return picked
+        draw *= 4  # most were rejected, draw more next time
+    return None
+
+def data_version(tree, table):
+    # changes whenever the songs or the tree change, older cached results are stale
+    return (table.version, getattr(tree, "version", 0))
+
+# row ids of the songs matching the filters, max_songs random ones for a playlist
+# all the matches are kept in cache (when given), and playlists are sampled
+# from them afterwards so a cached answer still gives a new playlist
+def find_matching_songs(tree, filters, structure_name, table, cache=None):
     matching_songs = [] # for keeping track songs based on the filters
-    seen_songs = set() # keep track of songs to prevent duplicating them in the playlist
-    start_time = time.time()
 
-    # getting the filters to use for the songs
-    for song in tree:
-        if filters.get("genres"):
-            song_genre = song.get("track_genre", "").lower()
-            if song_genre not in filters["genres"]:
-                continue
+    # a playlist only needs max_songs random matches, drawing those is tried
+    # first when the planner finds it cheaper than collecting every match
+    # drawing never reads or fills the cache: it gives no full match set to
+    # keep, so the cache only counts the queries that collect every match
+    plan = plan_for(tree, filters, table, sampling=True)
+    sampled = sample_songs(tree, filters, table, plan.candidates) if plan.access == "random sample" else None
+
+    key = query_key(structure_name, filters)
+    version = data_version(tree, table)
+    cached = cache.get(key, version) if cache is not None and sampled is None else None
+    if sampled is not None:
+        matching_songs = sampled
+    elif cached is not None:
+        matching_songs = list(cached)
+    else:
+        # getting the filters to use for the songs, in the order the planner picked
+        rows = candidate_rows(tree, filters, table)
 
-        if filters.get("explicit") is not None and song.get("explicit", False) != filters["explicit"]:
-            continue
+        # one row per song, copies share a song id
+        matching_songs = table.unique_songs(rows).tolist()
+        if cache is not None:
+            cache.put(key, version, tuple(matching_songs))
 
-        if filters.get("danceability") and not filters["danceability"][0] <= song.get("danceability", 0) <= filters["danceability"][1]:
-            continue
-        if filters.get("valence") and not filters["valence"][0] <= song.get("valence", 0) <= filters["valence"][1]:
-            continue
-        if filters.get("popularity") and not filters["popularity"][0] <= song.get("popularity", 0) <= filters["popularity"][1]:
-            continue
+    # max number of songs for the playlist
+    max_songs = filters.get("max_songs")
+    if max_songs and len(matching_songs) > max_songs:
+        matching_songs = random.sample(matching_songs, max_songs)
+    return matching_songs
 
-        # for keeping track of song name and artist together
-        song_id = (song.get("track_name", ""), song.get("artists", ""))  # Unique identifier
-        if song_id not in seen_songs:
-            matching_songs.append(song)
-            seen_songs.add(song_id)
+# recommend a list of songs based on the answers user enters
+def recommend_songs(tree, filters, structure_name, table, cache=None):
+    print(f"\nFinding songs using {structure_name}...")
 
+    start_time = time.time()
+    matching_songs = find_matching_songs(tree, filters, structure_name, table, cache)
     elapsed_time = time.time() - start_time
 
     if matching_songs:
-        # max number of songs for the playlist
-        max_songs = filters.get("max_songs")
-        if max_songs and len(matching_songs) > max_songs:
-            matching_songs = random.sample(matching_songs, max_songs)
-
         print(f"Found {len(matching_songs)} matching songs:")
-        for song in matching_songs:
+        for row in matching_songs:
+            song = table.record(row)
             print(
-                f"  Title: {song.get('track_name', 'Unknown')} by {song.get('artists', 'Unknown')}, "
-                f"Genre: {song.get('track_genre', 'Unknown')}, Danceability: {song.get('danceability', 0):.2f}"
+                f"  Title: {song['track_name']} by {song['artists']}, "
+                f"Genre: {song['track_genre']}, Danceability: {song['danceability']:.2f}"
             )
     else:
         print("No matching songs found.")
@@ -279,7 +426,7 @@ def select_genres_for_search(unique_genres):
 
     return selected_genres if selected_genres else None
 
-def search_songs(rbt, btree, unique_genres):
+def search_songs(tree, unique_genres, table, cache=None):
     # search by title, artist, or genre
     print("\nSearch the dataset for songs by:")
     print("1. Song title")
@@ -305,56 +452,117 @@ def search_songs(rbt, btree, unique_genres):
         print("Invalid choice. Returning to the main menu.")
         return
 
-    # red - black tree search
-    print("\nSearching using Red-Black Tree...")
+    # title and artist searches use the n-gram indexes and genre searches
+    # the genre index, so one pass is enough
+    print("\nSearching the song indexes...")
     start_time = time.time()
-    rbt_results = search_in_tree(rbt, filters)
-    rbt_time = time.time() - start_time
-
-    # B - tree search
-    print("\nSearching using B-Tree...")
-    start_time = time.time()
-    btree_results = search_in_tree(btree, filters)
-    btree_time = time.time() - start_time
+    results = search_in_tree(tree, filters, table, cache)
+    elapsed_time = time.time() - start_time
 
     # results
-    display_search_results(rbt_results, rbt_time, "Red-Black Tree")
-    display_search_results(btree_results, btree_time, "B-Tree")
-
-
-
-def search_in_tree(tree, filters):
-    # search song
-    results = []
-    for song in tree:
-        track_name = song.get("track_name", "")
-        artists = song.get("artists", "")
-        track_genre = song.get("track_genre", "")
-
-        # make strings, all lowercase, and compare them
-        track_name = str(track_name).lower() if isinstance(track_name, (str, float, int)) else ""
-        artists = str(artists).lower() if isinstance(artists, (str, float, int)) else ""
-        track_genre = str(track_genre).lower() if isinstance(track_genre, (str, float, int)) else ""
-
-
-        if "track_name" in filters and filters["track_name"] not in track_name:
-            continue
-        if "artists" in filters and filters["artists"] not in artists:
-            continue
-        if filters.get("genres"):
-            if track_genre not in filters["genres"]:
-                continue
+    display_search_results(results, elapsed_time, "Song Index", table)
+
+
+
+def search_in_tree(tree, filters, table, cache=None):
+    # search song, answers are kept in cache when one is given
+    if cache is not None:
+        key = query_key("search", filters)
+        version = data_version(tree, table)
+        cached = cache.get(key, version)
+        if cached is not None:
+            return list(cached)
+        results = search_in_tree(tree, filters, table)
+        cache.put(key, version, tuple(results))
+        return results
+
+    rows = None
+    for column in ("track_name", "artists"):
+        if column in filters:
+            found = table.text_indexes[column].search(filters[column])
+            rows = found if rows is None else np.intersect1d(rows, found)
+
+    # no text to look up, fall back to the tree and genre index
+    if rows is None:
+        return candidate_rows(tree, filters, table).tolist()
+
+    if filters.get("genres"):
+        rows = rows[table.genre_index.mask_for(filters["genres"])[rows]]
+    return rows.tolist()
+
+
+def find_similar_songs(similar, table):
+    # pick a seed song by title, then list the songs closest to it on
+    # danceability, valence, tempo and popularity
+    query = input("\nEnter the song title: ").strip().lower()
+    rows = table.text_indexes["track_name"].search(query)
+    if not len(rows):
+        print("No matching songs found.")
+        return
 
-        results.append(song)
+    choices = []
+    seen_songs = set()
+    for row, song_id in zip(rows.tolist(), table.song_ids[rows].tolist()):
+        if song_id not in seen_songs:
+            choices.append(row)
+            seen_songs.add(song_id)
+            if len(choices) == 10:
+                break
+    print("\nMatching Songs:")
+    for idx, row in enumerate(choices, start=1):
+        print(f"{idx}. {table.track_name[row]} by {table.artists[row]}")
+    choice = input("Enter your choice (or press Enter for the first one): ").strip()
+    seed = choices[int(choice) - 1] if choice.isdigit() and 1 <= int(choice) <= len(choices) else choices[0]
+
+    count_input = input("How many similar songs? (press Enter for 20): ").strip()
+    k = int(count_input) if count_input.isdigit() and int(count_input) > 0 else 20
+
+    print("\nOnly songs from the same genre?")
+    print("1. Yes")
+    print("Enter anything else if No")
+    genres = [table.genre_name(seed).lower()] if input("Enter your choice: ").strip() == "1" else None
 
-    return results
+    print("\nDo you want to include songs with explicit content?")
+    print("1. Yes (Include both explicit and non-explicit songs)")
+    print("Enter anything else if No (Only non-explicit songs)")
+    explicit = None if input("Enter your choice: ") == "1" else False
+
+    # the k-d tree is built on first use, build it before the timing so the
+    # comparison is of the lookups only
+    similar.kd_tree()
+    results = {}
+    times = {}
+    for method in ("brute", "tree"):
+        start_time = time.time()
+        results[method] = similar.similar_songs(seed, k, genres, explicit, method)
+        times[method] = time.time() - start_time
+
+    similar_rows, distances = results["tree"]
+    print(f"\nSongs like {table.track_name[seed]} by {table.artists[seed]}:")
+    for row, distance in zip(similar_rows.tolist(), distances.tolist()):
+        song = table.record(row)
+        print(
+            f"  Title: {song['track_name']} by {song['artists']}, "
+            f"Genre: {song['track_genre']}, Distance: {distance ** 0.5:.3f}"
+        )
+
+    print("\nComparison Summary:")
+    print(f"Brute Force: {len(results['brute'][0])} songs found, Query Time: {times['brute']:.6f} seconds")
+    print(f"K-D Tree: {len(results['tree'][0])} songs found, Query Time: {times['tree']:.6f} seconds")
+    # songs at the same distance may come back in another order, so compare the distances
+    brute_distances = results["brute"][1]
+    if len(brute_distances) == len(distances) and np.allclose(brute_distances, distances):
+        print("Both methods found the same nearest songs.")
+    else:
+        print("Warning: the brute force and k-d tree answers differ.")
 
 
-def display_search_results(results, elapsed_time, structure_name):
+def display_search_results(results, elapsed_time, structure_name, table):
     print(f"\n{structure_name} Results:")
     print(f"Found {len(results)} songs in {elapsed_time:.6f} seconds.")
     if results:
-        for song in results:  # show all of the results
+        for row in results:  # show all of the results
+            song = table.record(row)
             print(f"  Title: {song.get('track_name', 'Unknown')} by {song.get('artists', 'Unknown')}, "
                   f"Genre: {song.get('track_genre', 'Unknown')}")
     else:
@@ -362,23 +570,169 @@ def display_search_results(results, elapsed_time, structure_name):
 
 
 
-def main():
-    # load dataset
-    print("Loading song dataset...")
-    songs = load_song_dataset("dataset/songs_dataset.csv")
+def build_trees(table, distinct_songs=False):
+    # sort the songs by danceability once and build both trees from that
+    # the trees hold row ids into the song table, with distinct_songs a song's
+    # copies under other genres are left out when they match it on every
+    # filtered column, so the trees get smaller without changing any answer
+    order = table.dance_order
+    if distinct_songs:
+        order = order[table.song_variants()[1][order]]
+    sorted_songs = list(zip(table.danceability[order].tolist(), order.tolist()))
+    trees = RedBlackTree.from_sorted(sorted_songs), BTree.from_sorted(sorted_songs, order=4)
+    for tree in trees:
+        tree.distinct_songs = distinct_songs
+    return trees
+
 
-    unique_genres = sorted(set(song["track_genre"] for song in songs if song["track_genre"]))
+# structures a batch query can ask for, the red - black tree is the default
+BATCH_STRUCTURES = {"red_black_tree": "Red-Black Tree", "b_tree": "B-Tree", "kd_tree": "K-D Tree"}
 
-    # initialize the trees
-    print("Initializing data structures...")
-    rbt = RedBlackTree()
-    btree = BTree(order=4)
+# song table and trees of a batch run, loaded before the pool starts so
+# forked workers share them, a spawned worker loads its own copy (the
+# snapshot is memory mapped, so that copy is cheap)
+batch_state = None
 
-    # insert songs into trees
-    print("Inserting songs into data structures...")
-    for song in songs:
-        rbt.insert(song["danceability"], song)
-        btree.insert(song["danceability"], song)
+def load_batch_state(dataset_path):
+    global batch_state
+    if batch_state is None:
+        table = load_song_table(dataset_path)
+        rbt, btree = build_trees(table)
+        batch_state = {"table": table, "trees": {"red_black_tree": rbt, "b_tree": btree, "kd_tree": table.kd_tree}}
+    return batch_state
+
+# fields of a batch or server request that are not filters
+REQUEST_FIELDS = ("id", "structure", "type", "k", "row")
+
+def batch_filters(spec):
+    # a query from the jsonl file as the filter dict ask_user_questions builds
+    filters = {}
+    for name, value in spec.items():
+        if name in REQUEST_FIELDS:
+            continue
+        if name in ("danceability", "valence", "popularity", "tempo") and value is not None:
+            value = tuple(value)  # json has no tuples
+        elif name in ("track_name", "artists"):
+            value = str(value).strip().lower()
+        filters[name] = value
+    return filters
+
+def run_batch_query(job):
+    # answer one line of the query file, in a worker
+    line_number, line = job
+    table = batch_state["table"]
+    result = {"line": line_number}
+    rows = []
+    start_time = time.perf_counter()
+    try:
+        spec = json.loads(line)
+        result["id"] = spec.get("id")
+        structure = spec.get("structure", "red_black_tree")
+        if structure not in BATCH_STRUCTURES:
+            raise ValueError(f"unknown structure {structure!r}")
+        result["structure"] = structure
+        tree = batch_state["trees"][structure]
+        filters = batch_filters(spec)
+        if "track_name" in filters or "artists" in filters:
+            rows = search_in_tree(tree, filters, table)
+        else:
+            rows = find_matching_songs(tree, filters, BATCH_STRUCTURES[structure], table)
+    except (TypeError, ValueError, AttributeError) as error:
+        result["error"] = str(error)
+    result["elapsed"] = time.perf_counter() - start_time
+
+    result["count"] = len(rows)
+    result["songs"] = [song_json(table, row) for row in rows]
+    return result
+
+def song_json(table, row):
+    # one song of an answer, missing text as null since json has no nan
+    song = table.record(row)
+    return {
+        "row": row,
+        "track_name": song["track_name"] if isinstance(song["track_name"], str) else None,
+        "artists": song["artists"] if isinstance(song["artists"], str) else None,
+        "track_genre": song["track_genre"],
+    }
+
+def run_batch(queries_path, output_path, dataset_path, workers):
+    # answer every query in a jsonl file (one filter or search dict per line)
+    # without any prompts, spread over a pool of processes
+    # writes one json line per query, in the same order, with its timing
+    load_batch_state(dataset_path)
+    with open(queries_path) as lines:
+        jobs = [(line_number, line) for line_number, line in enumerate(lines, start=1) if line.strip()]
+
+    start_time = time.perf_counter()
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with context.Pool(workers, initializer=load_batch_state, initargs=(dataset_path,)) as pool, open(output_path, "w") as output:
+        for result in pool.imap(run_batch_query, jobs, chunksize=16):
+            output.write(json.dumps(result) + "\n")
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Answered {len(jobs)} queries in {elapsed_time:.3f} seconds with {workers} workers, results in {output_path}.")
+
+
+def compare_structures(structures, filters, table, query_cache, show_stats=False, explain=False):
+    # run the same query on every structure and print a comparison between them
+    # with show_stats the trees count what they did for this query, with
+    # explain the plan each structure gets is shown first
+    if explain:
+        for structure_name, tree in structures.items():
+            print(f"\n{structure_name} Plan:")
+            for line in explain_query(tree, filters, table):
+                print(f"  {line}")
+    if show_stats:
+        for tree in structures.values():
+            if hasattr(tree, "enable_stats"):
+                tree.enable_stats()  # counts start from zero
+
+    found = {}
+    for structure_name, tree in structures.items():
+        found[structure_name] = recommend_songs(tree, filters, structure_name, table, query_cache)
+
+    print("\nComparison Summary:")
+    for structure_name, (songs, elapsed_time) in found.items():
+        print(f"{structure_name}: {len(songs)} songs found, Query Time: {elapsed_time:.6f} seconds")
+    cache_counters = query_cache.counters()
+    print(f"Query Cache: {cache_counters['hits']} hits, {cache_counters['misses']} misses, "
+          f"{cache_counters['evictions']} evictions")
+    if show_stats:
+        for structure_name, tree in structures.items():
+            if hasattr(tree, "stats"):
+                stats = tree.stats()
+                print(f"{structure_name} Stats: " + ", ".join(f"{name.replace('_', ' ')} {value}" for name, value in stats.items()))
+
+    if not any(songs for songs, _ in found.values()):
+        print("\nNo songs matched your filters. Try adjusting your preferences.")
+
+
+def wait_for(loader, *names):
+    # results of the background loading steps, saying so when the user has to wait
+    if all(loader.ready(name) for name in names):
+        return [loader.get(name) for name in names]
+    print("Still loading the catalog, one moment...")
+    start_time = time.perf_counter()
+    results = [loader.get(name) for name in names]
+    print(f"Catalog ready after waiting {time.perf_counter() - start_time:.3f} seconds.")
+    return results
+
+def loaded_structures(loader):
+    table, (rbt, btree), shards = wait_for(loader, "table", "trees", "shards")
+    return {"Red-Black Tree": rbt, "B-Tree": btree, "K-D Tree": table.kd_tree, "Genre Shards": shards}
+
+
+def main(dataset_path="dataset/songs_dataset.csv", show_stats=False, distinct_songs=False, explain=False):
+    # load dataset and build the structures in the background, the menu
+    # comes up straight away and each choice only waits for what it uses
+    print("Loading song dataset...")
+    loader = BackgroundLoader([
+        ("table", lambda: load_song_table(dataset_path)),
+        ("trees", lambda: build_trees(loader.get("table"), distinct_songs)),
+        ("shards", lambda: GenreShards.build(loader.get("table"))),
+    ]).start()
+    similar = None  # made on first use
+    query_cache = QueryCache(max_entries=256)
+    first_prompt = True
 
     while True:
         print("\nMusic Recommendation System")
@@ -386,42 +740,68 @@ def main():
         print("1. Create a playlist")
         print("2. Find all songs that meet your criteria")
         print("3. Search the dataset")
-        print("4. Exit")
+        print("4. Apply a catalog update file")
+        print("5. Find songs like a song")
+        print("6. Exit")
 
+        if first_prompt:
+            print(f"Startup: first prompt after {time.perf_counter() - START_TIME:.3f} seconds.")
+            first_prompt = False
         choice = input("Enter your choice: ")
-        if choice == "4":
+        if choice == "6":
             print("Exiting the program. Goodbye!")
             break
-        elif choice == "1":
-            filters = ask_user_questions(unique_genres, ask_max_songs=True)
-            rbt_songs, rbt_time = recommend_songs(rbt, filters, "Red-Black Tree")
-            btree_songs, btree_time = recommend_songs(btree, filters, "B-Tree")
-
-            # print a comparison between the trees
-            print("\nComparison Summary:")
-            print(f"Red-Black Tree: {len(rbt_songs)} songs found, Query Time: {rbt_time:.6f} seconds")
-            print(f"B-Tree: {len(btree_songs)} songs found, Query Time: {btree_time:.6f} seconds")
-
-            if not rbt_songs and not btree_songs:
-                print("\nNo songs matched your filters. Try adjusting your preferences.")
-        elif choice == "2":
-            filters = ask_user_questions(unique_genres, ask_max_songs=False)
-            rbt_songs, rbt_time = recommend_songs(rbt, filters, "Red-Black Tree")
-            btree_songs, btree_time = recommend_songs(btree, filters, "B-Tree")
-
-            print("\nComparison Summary:")
-            print(f"Red-Black Tree: {len(rbt_songs)} songs found, Query Time: {rbt_time:.6f} seconds")
-            print(f"B-Tree: {len(btree_songs)} songs found, Query Time: {btree_time:.6f} seconds")
-
-            if not rbt_songs and not btree_songs:
-                print("\nNo songs matched your filters. Try adjusting your preferences.")
+        elif choice in ("1", "2"):
+            # the questions only need the genre list, the trees can finish meanwhile
+            table, = wait_for(loader, "table")
+            filters = ask_user_questions(table.genres, ask_max_songs=choice == "1")
+            compare_structures(loaded_structures(loader), filters, table, query_cache, show_stats, explain)
         elif choice == "3":
-            search_songs(rbt, btree, unique_genres)
+            table, (rbt, _) = wait_for(loader, "table", "trees")
+            search_songs(rbt, table.genres, table, query_cache)
+        elif choice == "4":
+            # removes, changes and adds songs in place, no full reload needed
+            filepath = input("Path to the update csv: ").strip()
+            table, (rbt, btree), _ = wait_for(loader, "table", "trees", "shards")
+            start_time = time.time()
+            try:
+                counts = apply_song_delta(table, [] if distinct_songs else [rbt, btree], filepath)
+            except (OSError, ValueError) as error:
+                print(f"Could not apply the update: {error}")
+                continue
+            if distinct_songs:
+                # which row is a song's first copy may have changed, build again
+                loader.set("trees", build_trees(table, distinct_songs))
+            if similar is not None:
+                similar.invalidate()
+            loader.set("shards", GenreShards.build(table))  # rebuilt in parallel, genres may have moved
+            elapsed_time = time.time() - start_time
+            print(f"Added {counts['add']}, removed {counts['remove']}, updated {counts['update']} songs "
+                  f"({counts['skipped']} skipped) in {elapsed_time:.6f} seconds.")
+        elif choice == "5":
+            table, = wait_for(loader, "table")
+            if similar is None:
+                similar = SimilarityIndex(table)
+            find_similar_songs(similar, table)
         else:
             print("Invalid choice. Please try again.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Music recommendation system")
+    parser.add_argument("--dataset", default="dataset/songs_dataset.csv", help="song csv to load")
+    parser.add_argument("--batch", metavar="QUERIES", help="answer the queries in a jsonl file instead of asking")
+    parser.add_argument("--output", default="results.jsonl", help="where batch results are written")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for batch mode")
+    parser.add_argument("--stats", action="store_true", help="show what the trees did for each query")
+    parser.add_argument("--distinct-songs", action="store_true",
+                        help="keep one row per song in the trees instead of one per genre it is listed under "
+                             "(copies that differ in a filtered column keep their own row)")
+    parser.add_argument("--explain", action="store_true", help="show the query plan each structure gets")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.output, args.dataset, args.workers)
+    else:
+        main(args.dataset, args.stats, args.distinct_songs, args.explain)
 
 
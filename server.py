@@ -0,0 +1,177 @@
+# long running query server: loads the catalog and trees once, then answers
+# json line requests over tcp or a unix socket, many connections at a time
+# run from the repo root: python server.py --port 8765 (or --unix /tmp/songs.sock)
+#
+# one request per line, the same fields batch mode reads plus a type:
+#   {"id": 1, "type": "playlist", "genres": ["pop"], "danceability": [0.7, 1.0], "max_songs": 20}
+#   {"id": 2, "type": "search", "track_name": "love"}
+#   {"id": 3, "type": "closest", "danceability": 0.72, "k": 50}
+#   {"id": 4, "type": "similar", "row": 123, "k": 20, "genres": ["pop"], "explicit": false}
+#   {"id": 5, "type": "stats"}
+#   {"id": 6, "type": "explain", "genres": ["pop"], "danceability": [0.7, 1.0]}
+# every song of an answer is streamed back as its own line, then a done line
+# with the count and the time taken
+import argparse
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from main import BATCH_STRUCTURES, batch_filters, build_trees, explain_query, find_matching_songs, search_in_tree, song_json
+from src.dataset_utils import load_song_table
+from src.query_cache import QueryCache
+from src.similarity import SIMILARITY_COLUMNS, SimilarityIndex
+
+# songs written per chunk before waiting for the client to catch up
+STREAM_CHUNK = 256
+# latencies the stats request reports on, the most recent ones
+LATENCY_WINDOW = 10_000
+
+
+class QueryServer:
+    def __init__(self, dataset_path):
+        self.table = load_song_table(dataset_path)
+        rbt, btree = build_trees(self.table)
+        self.trees = {"red_black_tree": rbt, "b_tree": btree, "kd_tree": self.table.kd_tree}
+        self.similar = SimilarityIndex(self.table)
+        self.similar.kd_tree()  # build the tree now, not on the first request
+        self.cache = QueryCache(max_entries=1024)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)  # seconds per answered request
+
+    def answer(self, spec):
+        # row ids answering one request, runs in the executor
+        kind = spec.get("type", "playlist")
+        structure = spec.get("structure", "red_black_tree")
+        if structure not in BATCH_STRUCTURES:
+            raise ValueError(f"unknown structure {structure!r}")
+        tree = self.trees[structure]
+        k = int(spec.get("k", 20))
+        if kind == "closest":
+            if not hasattr(tree, "find_k_closest"):
+                raise ValueError(f"{structure} has no closest lookup")
+            return tree.find_k_closest(float(spec["danceability"]), k)
+
+        if kind == "playlist":
+            return find_matching_songs(tree, batch_filters(spec), BATCH_STRUCTURES[structure], self.table, self.cache)
+        if kind == "search":
+            return search_in_tree(tree, batch_filters(spec), self.table, self.cache)
+        if kind == "similar":
+            # a seed row, or feature values given in the request, so the
+            # feature columns here are single numbers and not filter bands
+            seed = int(spec["row"]) if "row" in spec else {column: float(spec[column]) for column in SIMILARITY_COLUMNS if column in spec}
+            if not isinstance(seed, dict) and not 0 <= seed < len(self.table):
+                raise ValueError(f"no song with row {seed}")
+            rows, _ = self.similar.similar_songs(seed, k, spec.get("genres"), spec.get("explicit"))
+            return rows.tolist()
+        raise ValueError(f"unknown request type {kind!r}")
+
+    def answer_lines(self, spec):
+        # (song count, encoded chunks of song lines) answering one request,
+        # the lines are made in the executor too, so a large answer does not
+        # hold up the other connections
+        request_id = spec.get("id")
+        rows = self.answer(spec)
+        chunks = []
+        for start in range(0, len(rows), STREAM_CHUNK):
+            lines = [json.dumps({"id": request_id, "song": song_json(self.table, row)}) for row in rows[start:start + STREAM_CHUNK]]
+            chunks.append(("\n".join(lines) + "\n").encode())
+        return len(rows), chunks
+
+    def explain(self, spec):
+        # the plan a playlist request would get, as lines of text
+        structure = spec.get("structure", "red_black_tree")
+        if structure not in BATCH_STRUCTURES:
+            raise ValueError(f"unknown structure {structure!r}")
+        return explain_query(self.trees[structure], batch_filters(spec), self.table)
+
+    def stats(self):
+        # percentiles over the last LATENCY_WINDOW requests
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            "requests": len(self.latencies),
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "cache": self.cache.counters(),
+        }
+
+    async def handle(self, reader, writer):
+        # requests on one connection are answered in order, connections run side by side
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await self.respond(line, writer)
+        except ConnectionError:
+            pass  # client went away
+        finally:
+            writer.close()
+
+    async def respond(self, line, writer):
+        start_time = time.perf_counter()
+        request_id = None
+        try:
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise ValueError("a request is a json object")
+            request_id = spec.get("id")
+            if spec.get("type") == "stats":
+                writer.write(json.dumps({"id": request_id, "done": True, **self.stats()}).encode() + b"\n")
+                await writer.drain()
+                return
+            if spec.get("type") == "explain":
+                writer.write(json.dumps({"id": request_id, "done": True, "plan": self.explain(spec)}).encode() + b"\n")
+                await writer.drain()
+                return
+            count, chunks = await asyncio.get_running_loop().run_in_executor(None, self.answer_lines, spec)
+        except (KeyError, TypeError, ValueError) as error:
+            writer.write(json.dumps({"id": request_id, "error": str(error)}).encode() + b"\n")
+            await writer.drain()
+            return
+
+        for chunk in chunks:
+            writer.write(chunk)
+            await writer.drain()
+
+        elapsed_time = time.perf_counter() - start_time
+        self.latencies.append(elapsed_time)
+        writer.write(json.dumps({"id": request_id, "done": True, "count": count, "elapsed": elapsed_time}).encode() + b"\n")
+        await writer.drain()
+
+
+async def serve(query_server, host, port, unix_path, threads):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+    if unix_path:
+        server = await asyncio.start_unix_server(query_server.handle, path=unix_path)
+        where = unix_path
+    else:
+        server = await asyncio.start_server(query_server.handle, host, port)
+        where = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Serving {len(query_server.table)} songs on {where}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Music recommendation query server")
+    parser.add_argument("--dataset", default="dataset/songs_dataset.csv", help="song csv to load")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a unix socket instead of tcp")
+    parser.add_argument("--threads", type=int, default=4, help="executor threads for the queries")
+    args = parser.parse_args()
+
+    query_server = QueryServer(args.dataset)
+    try:
+        asyncio.run(serve(query_server, args.host, args.port, args.unix, args.threads))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+from bisect import bisect_left, bisect_right
+
+
+class BPlusTreeLeaf:
+    __slots__ = ("keys", "values", "next", "prev")
+
+    # values only live in the leaves, which are linked to their neighbours
+    def __init__(self):
+        self.keys = []
+        self.values = []
+        self.next = None
+        self.prev = None
+
+
+class BPlusTreeInternal:
+    __slots__ = ("keys", "children")
+
+    # keys[i] is the smallest key in children[i + 1]
+    def __init__(self):
+        self.keys = []
+        self.children = []
+
+
+class BPlusTreeCursor:
+    # position between two entries of a BPlusTree, as (leaf, index)
+    # the leaves are linked, so moving never goes back up the tree
+    def __init__(self, tree):
+        self.tree = tree
+        self.leaf = tree.first_leaf()
+        self.index = 0  # the position is just before leaf.keys[index]
+
+    def seek(self, key, inclusive=True):
+        # move to just before the first entry with key >= key (key > key if not inclusive)
+        self.leaf, self.index = self.tree.find_position(key, inclusive)
+        return self
+
+    def seek_end(self):
+        # move past the last entry, prev then walks backwards from the end
+        self.leaf = self.tree.last_leaf()
+        self.index = len(self.leaf.keys)
+        return self
+
+    def next(self):
+        # (key, value) after the position and step over it, None at the end
+        leaf = self.leaf
+        while leaf is not None and self.index >= len(leaf.keys):
+            if leaf.next is None:
+                return None
+            leaf = self.leaf = leaf.next
+            self.index = 0
+        if leaf is None:
+            return None
+        i = self.index
+        self.index = i + 1
+        return leaf.keys[i], leaf.values[i]
+
+    def prev(self):
+        # (key, value) before the position and step back over it, None at the start
+        leaf = self.leaf
+        while leaf is not None and self.index == 0:
+            if leaf.prev is None:
+                return None
+            leaf = self.leaf = leaf.prev
+            self.index = len(leaf.keys)
+        if leaf is None:
+            return None
+        self.index -= 1
+        return leaf.keys[self.index], leaf.values[self.index]
+
+    def close(self):
+        # drop the references into the tree, next and prev give None after this
+        self.tree = None
+        self.leaf = None
+        self.index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BPlusTree:
+    # b+ tree version of BTree: keys kept in sorted lists searched with
+    # bisect, values only in the leaves and the leaves linked left to right
+    # order is the most children an internal node (or keys a leaf) can hold
+    def __init__(self, order=32):
+        if order < 3:
+            raise ValueError("order must be at least 3")
+        self.order = order
+        self.root = BPlusTreeLeaf()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_sorted(cls, items, order=32, fill_factor=1.0):
+        # build the tree bottom up from (key, value) pairs already sorted by key
+        # leaves (and internal nodes) are packed to about fill_factor of order
+        items = items if isinstance(items, list) else list(items)
+        tree = cls(order=order)
+        if not items:
+            return tree
+        per_node = min(order, max(2, order // 2, round(fill_factor * order)))
+
+        leaves = []
+        for start, end in cls.chunk_bounds(len(items), per_node):
+            leaf = BPlusTreeLeaf()
+            leaf.keys = [key for key, _ in items[start:end]]
+            leaf.values = [value for _, value in items[start:end]]
+            if leaves:
+                leaves[-1].next = leaf
+                leaf.prev = leaves[-1]
+            leaves.append(leaf)
+
+        # each level up groups the nodes below and keeps the smallest key of each
+        level = leaves
+        lows = [leaf.keys[0] for leaf in leaves]
+        while len(level) > 1:
+            parents = []
+            parent_lows = []
+            for start, end in cls.chunk_bounds(len(level), per_node):
+                node = BPlusTreeInternal()
+                node.children = level[start:end]
+                node.keys = lows[start + 1:end]
+                parents.append(node)
+                parent_lows.append(lows[start])
+            level, lows = parents, parent_lows
+        tree.root = level[0]
+        tree.size = len(items)
+        return tree
+
+    @staticmethod
+    def chunk_bounds(count, per_node):
+        # (start, end) of count items split into even chunks of at most per_node
+        chunks = -(-count // per_node)
+        size, extra = divmod(count, chunks)
+        start = 0
+        bounds = []
+        for i in range(chunks):
+            end = start + size + (1 if i < extra else 0)
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    @classmethod
+    def bulk_load(cls, iterable, order=32, fill_factor=1.0):
+        # sort the (key, value) pairs once, then build bottom up
+        return cls.from_sorted(sorted(iterable, key=lambda item: item[0]), order, fill_factor)
+
+    def first_leaf(self):
+        node = self.root
+        while isinstance(node, BPlusTreeInternal):
+            node = node.children[0]
+        return node
+
+    def last_leaf(self):
+        node = self.root
+        while isinstance(node, BPlusTreeInternal):
+            node = node.children[-1]
+        return node
+
+    def find_position(self, key, inclusive=True):
+        # (leaf, index) of the first entry with key >= key (key > key if not inclusive)
+        # equal keys can sit on both sides of a separator, so go left of equal ones
+        search = bisect_left if inclusive else bisect_right
+        node = self.root
+        while isinstance(node, BPlusTreeInternal):
+            node = node.children[search(node.keys, key)]
+        return node, search(node.keys, key)
+
+    def cursor(self):
+        # cursor before the first entry, use seek to start somewhere else
+        return BPlusTreeCursor(self)
+
+    def __iter__(self):
+        # one walk along the leaf chain
+        leaf = self.first_leaf()
+        while leaf is not None:
+            yield from leaf.values
+            leaf = leaf.next
+
+    def __reversed__(self):
+        leaf = self.last_leaf()
+        while leaf is not None:
+            yield from reversed(leaf.values)
+            leaf = leaf.prev
+
+    def range(self, lo, hi, inclusive=True):
+        # yield values with lo <= key <= hi (or lo < key < hi if not inclusive)
+        # one descent to the lower bound, then along the leaf chain
+        leaf, i = self.find_position(lo, inclusive)
+        search = bisect_right if inclusive else bisect_left
+        while leaf is not None:
+            end = search(leaf.keys, hi)
+            yield from leaf.values[i:end]
+            if end < len(leaf.keys):
+                return
+            leaf = leaf.next
+            i = 0
+
+    def insert(self, key, value):
+        # insert new key and value pair, equal keys go after the ones already there
+        path = []
+        node = self.root
+        while isinstance(node, BPlusTreeInternal):
+            i = bisect_right(node.keys, key)
+            path.append((node, i))
+            node = node.children[i]
+
+        i = bisect_right(node.keys, key)
+        node.keys.insert(i, key)
+        node.values.insert(i, value)
+        self.size += 1
+        if len(node.keys) <= self.order:
+            return
+
+        # split full nodes on the way back up
+        separator, right = self.split_leaf(node)
+        while path:
+            parent, i = path.pop()
+            parent.keys.insert(i, separator)
+            parent.children.insert(i + 1, right)
+            if len(parent.children) <= self.order:
+                return
+            separator, right = self.split_internal(parent)
+
+        new_root = BPlusTreeInternal()
+        new_root.keys = [separator]
+        new_root.children = [self.root, right]
+        self.root = new_root
+
+    def split_leaf(self, leaf):
+        # move the upper half into a new leaf linked after this one
+        mid = len(leaf.keys) // 2
+        right = BPlusTreeLeaf()
+        right.keys = leaf.keys[mid:]
+        right.values = leaf.values[mid:]
+        del leaf.keys[mid:]
+        del leaf.values[mid:]
+
+        right.next = leaf.next
+        if leaf.next is not None:
+            leaf.next.prev = right
+        right.prev = leaf
+        leaf.next = right
+        return right.keys[0], right
+
+    def split_internal(self, node):
+        # move the upper half into a new node, the middle key goes up
+        mid = len(node.keys) // 2
+        right = BPlusTreeInternal()
+        separator = node.keys[mid]
+        right.keys = node.keys[mid + 1:]
+        right.children = node.children[mid + 1:]
+        del node.keys[mid:]
+        del node.children[mid + 1:]
+        return separator, right
+
+    def find_closest(self, key):
+        # the closest key is either the first one >= key or the one before it
+        cursor = self.cursor().seek(key)
+        after = cursor.next()
+        if after is not None:
+            cursor.prev()
+        before = cursor.prev()
+        if after is None or (before is not None and key - before[0] <= after[0] - key):
+            return before[1] if before is not None else None
+        return after[1]
@@ -1,9 +1,123 @@
+import random
+
+
+# events counted once stats are turned on with enable_stats
+STAT_EVENTS = ("inserts", "deletes", "splits", "merges", "borrows", "nodes_visited", "key_comparisons")
+
+
 class BTreeNode:
+    __slots__ = ("keys", "children", "leaf", "size")  # no __dict__ per node
+
     # initialize b - tree node
     def __init__(self, leaf=False):
         self.keys = []  # (key, value) pairs
         self.children = []
         self.leaf = leaf  # true if  node is a leaf
+        self.size = 0  # entries in the subtree under this node, its own keys included
+
+
+class BTreeCursor:
+    # position between two entries of a BTree, kept as an explicit stack of
+    # [node, i] frames from the root down instead of nested generators
+    # in a leaf frame the position is just before keys[i], in the frames
+    # above it the position is inside children[i], just before keys[i]
+    def __init__(self, tree):
+        self.tree = tree
+        self.stack = []
+        self.descend_left(tree.root)
+
+    def descend_left(self, node):
+        # down the left edge of a subtree, to just before its smallest key
+        while True:
+            self.stack.append([node, 0])
+            if node.leaf:
+                return
+            node = node.children[0]
+
+    def descend_right(self, node):
+        # down the right edge of a subtree, to just after its largest key
+        while True:
+            self.stack.append([node, len(node.keys)])
+            if node.leaf:
+                return
+            node = node.children[-1]
+
+    def seek(self, key, inclusive=True):
+        # move to just before the first entry with key >= key (key > key if not inclusive)
+        self.stack = []
+        node = self.tree.root
+        counters = self.tree.counters
+        while True:
+            i = 0
+            while i < len(node.keys) and (node.keys[i][0] < key or (not inclusive and node.keys[i][0] == key)):
+                i += 1
+            if counters is not None:
+                self.tree.count_visit(node, i)
+            self.stack.append([node, i])
+            if node.leaf:
+                return self
+            node = node.children[i]
+
+    def seek_end(self):
+        # move past the last entry, prev then walks backwards from the end
+        self.stack = []
+        return self
+
+    def next(self):
+        # (key, value) after the position and step over it, None at the end
+        stack = self.stack
+        while stack:
+            frame = stack[-1]
+            node, i = frame
+            if i < len(node.keys):
+                frame[1] = i + 1
+                if not node.leaf:
+                    self.descend_left(node.children[i + 1])
+                return node.keys[i]
+            stack.pop()
+        return None
+
+    def prev(self):
+        # (key, value) before the position and step back over it, None at the start
+        stack = self.stack
+        if not stack:
+            if self.tree is None:
+                return None
+            self.descend_right(self.tree.root)
+        while True:
+            frame = stack[-1]
+            node, i = frame
+            if not node.leaf:
+                # just after children[i], its largest key comes first
+                self.descend_right(node.children[i])
+                continue
+            if i > 0:
+                frame[1] = i - 1
+                return node.keys[i - 1]
+
+            # at the start of a leaf, climb to the first key on the left
+            stack.pop()
+            while stack and stack[-1][1] == 0:
+                stack.pop()
+            if not stack:
+                self.descend_left(self.tree.root)  # stay at the start
+                return None
+            frame = stack[-1]
+            node, i = frame
+            frame[1] = i - 1
+            self.descend_right(node.children[i - 1])
+            return node.keys[i - 1]
+
+    def close(self):
+        # drop the references into the tree, next and prev give None after this
+        self.tree = None
+        self.stack = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class BTree:
@@ -11,6 +125,68 @@ class BTree:
     def __init__(self, order=4):
         self.order = order # tree degree
         self.root = BTreeNode(leaf=True) # empty leaf to begin
+        self.version = 0  # goes up on every insert and delete, for cached results
+        self.counters = None  # event counts, only kept after enable_stats
+
+    @classmethod
+    def from_sorted(cls, items, order=4, fill_factor=1.0):
+        # build the tree bottom up from (key, value) pairs already sorted by key
+        # each node is packed to about fill_factor of its max size, linear time
+        items = items if isinstance(items, list) else list(items)
+        tree = cls(order=order)
+        if not items:
+            return tree
+
+        max_keys = (2 * order) - 1
+        target = min(max_keys, max(order - 1, round(fill_factor * max_keys)))
+
+        # leaf level, then one level of separators at a time up to the root
+        level_keys = items
+        level_children = None
+        while True:
+            count = len(level_keys)
+            if count <= max_keys:
+                tree.root = cls.packed_node(level_keys, level_children)
+                return tree
+
+            # enough nodes so none overflows, but as few as the target allows
+            node_count = max(-(-(count + 1) // (max_keys + 1)), (count + 1) // (target + 1))
+            per_node, extra = divmod(count - (node_count - 1), node_count)
+
+            nodes = []
+            separators = []
+            start = 0
+            child_start = 0
+            for i in range(node_count):
+                size = per_node + (1 if i < extra else 0)
+                children = None
+                if level_children is not None:
+                    children = level_children[child_start:child_start + size + 1]
+                    child_start += size + 1
+                nodes.append(cls.packed_node(level_keys[start:start + size], children))
+                start += size
+                if i < node_count - 1:
+                    separators.append(level_keys[start])
+                    start += 1
+
+            level_keys = separators
+            level_children = nodes
+
+    @staticmethod
+    def packed_node(keys, children):
+        # node for from_sorted, a leaf when there are no children
+        node = BTreeNode(leaf=children is None)
+        node.keys = list(keys)
+        node.size = len(node.keys)
+        if children is not None:
+            node.children = children
+            node.size += sum(child.size for child in children)
+        return node
+
+    @classmethod
+    def bulk_load(cls, iterable, order=4, fill_factor=1.0):
+        # sort the (key, value) pairs once, then build bottom up
+        return cls.from_sorted(sorted(iterable, key=lambda item: item[0]), order, fill_factor)
 
     def traverse(self, node):
         # in order traversal for the b - tree
@@ -25,15 +201,51 @@ class BTree:
             if len(node.children) > 0:
                 yield from self.traverse(node.children[-1])
 
+    def cursor(self):
+        # cursor before the first entry, use seek to start somewhere else
+        return BTreeCursor(self)
+
     def __iter__(self):
-        return self.traverse(self.root)
+        cursor = self.cursor()
+        stack = cursor.stack
+        while stack:
+            node, i = stack[-1]
+            if node.leaf:
+                # most keys sit in leaves, hand out the rest of the leaf in one go
+                for _, value in node.keys[i:]:
+                    yield value
+                stack.pop()
+            else:
+                item = cursor.next()
+                if item is not None:
+                    yield item[1]
+
+    def __reversed__(self):
+        cursor = self.cursor().seek_end()
+        item = cursor.prev()
+        while item is not None:
+            yield item[1]
+            item = cursor.prev()
+
+    def range(self, lo, hi, inclusive=True):
+        # yield values with lo <= key <= hi (or lo < key < hi if not inclusive)
+        # seeks straight to the lower bound and stops after the upper bound
+        cursor = self.cursor().seek(lo, inclusive)
+        item = cursor.next()
+        while item is not None and (item[0] < hi or (inclusive and item[0] == hi)):
+            yield item[1]
+            item = cursor.next()
 
     def insert(self, key, value):
         # insert new key and value pair in the b - tree
+        self.version += 1
+        if self.counters is not None:
+            self.counters["inserts"] += 1
         root = self.root
         # split if root is full
         if len(root.keys) == (2 * self.order) - 1:
             new_node = BTreeNode(leaf=False) # new becomes non leaf
+            new_node.size = root.size
             self.root = new_node
             new_node.children.append(root) # old becomes child
             self.split_child(new_node, 0)
@@ -43,6 +255,7 @@ class BTree:
 
     def insert_non_full(self, node, key, value):
         # insert key to an available node
+        node.size += 1  # the new key ends up somewhere under this node
         i = len(node.keys) - 1
         if node.leaf:
             node.keys.append((None, None))  # temp
@@ -50,10 +263,14 @@ class BTree:
                 node.keys[i + 1] = node.keys[i]
                 i -= 1
             node.keys[i + 1] = (key, value)
+            if self.counters is not None:
+                self.count_visit(node, len(node.keys) - 2 - i)
         else:
             while i >= 0 and key < node.keys[i][0]:
                 i -= 1
             i += 1
+            if self.counters is not None:
+                self.count_visit(node, len(node.keys) - i)
             # split if child is full
             if len(node.children[i].keys) == (2 * self.order) - 1:
                 self.split_child(node, i)
@@ -63,6 +280,8 @@ class BTree:
 
     def split_child(self, parent, index):
         # split child into 2 nodes
+        if self.counters is not None:
+            self.counters["splits"] += 1
         full_node = parent.children[index]
         mid = self.order - 1 # mid point
 
@@ -79,29 +298,229 @@ class BTree:
             new_node.children = full_node.children[mid + 1:]
             full_node.children = full_node.children[:mid + 1]
 
-    def find_closest(self, key):
-        # find the key and value pair w closest key
-        def closest_in_node(node, key):
-            closest_pair = None
-            closest_diff = float('inf')
-            for i, (k, v) in enumerate(node.keys):
-                diff = abs(k - key)
-                if diff < closest_diff:
-                    closest_pair = (k, v)
-                    closest_diff = diff
-            return closest_pair
-
-        current = self.root
-        closest_pair = None
-        while current:
-            closest_pair = closest_in_node(current, key)
-            if not current.leaf:
-                for i, (k, _) in enumerate(current.keys):
-                    if key < k:
-                        current = current.children[i]
-                        break
-                else:
-                    current = current.children[-1]
-            else:
+        # the parent's size stays the same, only the entries moved
+        new_node.size = len(new_node.keys) + sum(child.size for child in new_node.children)
+        full_node.size -= new_node.size + 1
+
+    def find_path(self, node, key, value, path):
+        # fill path with [node, i] frames from node down to the entry with this
+        # key and value, frames above the last one hold the child index taken
+        # equal keys can be on both sides of a separator, so every child that
+        # may hold the key is looked at
+        i = 0
+        while i < len(node.keys) and node.keys[i][0] < key:
+            i += 1
+        while True:
+            if not node.leaf:
+                path.append([node, i])
+                if self.find_path(node.children[i], key, value, path):
+                    return True
+                path.pop()
+            if i == len(node.keys) or node.keys[i][0] != key:
+                return False
+            if node.keys[i][1] == value:
+                path.append([node, i])
+                return True
+            i += 1
+
+    def delete(self, key, value):
+        # remove the entry with this key and value (e.g. a song's row id)
+        # returns False when it is not in the tree
+        path = []
+        if not self.find_path(self.root, key, value, path):
+            return False
+        self.version += 1
+        if self.counters is not None:
+            self.counters["deletes"] += 1
+
+        node, i = path[-1]
+        if node.leaf:
+            node.keys.pop(i)
+        else:
+            # swap in the largest entry of the left subtree, then remove that from its leaf
+            child = node.children[i]
+            while True:
+                path.append([child, len(child.keys)])
+                if child.leaf:
+                    break
+                child = child.children[-1]
+            node.keys[i] = child.keys.pop()
+
+        for node, _ in path:
+            node.size -= 1
+        self.fix_underflow(path)
+        return True
+
+    def update(self, key, value, new_key):
+        # move an entry to a new key, e.g. when a song's danceability changes
+        if not self.delete(key, value):
+            return False
+        self.insert(new_key, value)
+        return True
+
+    def fix_underflow(self, path):
+        # walk back up after a delete, borrowing from or merging with a
+        # sibling until every node has at least order - 1 keys again
+        min_keys = self.order - 1
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth][0]
+            if len(node.keys) >= min_keys:
                 break
-        return closest_pair[1] if closest_pair else None
+            parent, index = path[depth - 1]
+            left = parent.children[index - 1] if index > 0 else None
+            right = parent.children[index + 1] if index + 1 < len(parent.children) else None
+
+            if left is not None and len(left.keys) > min_keys:
+                # borrow through the parent from the left sibling
+                self.count_event("borrows")
+                node.keys.insert(0, parent.keys[index - 1])
+                parent.keys[index - 1] = left.keys.pop()
+                moved = 1
+                if not node.leaf:
+                    node.children.insert(0, left.children.pop())
+                    moved += node.children[0].size
+                node.size += moved
+                left.size -= moved
+            elif right is not None and len(right.keys) > min_keys:
+                # borrow through the parent from the right sibling
+                self.count_event("borrows")
+                node.keys.append(parent.keys[index])
+                parent.keys[index] = right.keys.pop(0)
+                moved = 1
+                if not node.leaf:
+                    node.children.append(right.children.pop(0))
+                    moved += node.children[-1].size
+                node.size += moved
+                right.size -= moved
+            elif left is not None:
+                # merge into the left sibling along with the separator
+                self.count_event("merges")
+                left.keys.append(parent.keys.pop(index - 1))
+                left.keys.extend(node.keys)
+                left.children.extend(node.children)
+                left.size += node.size + 1
+                parent.children.pop(index)
+            else:
+                # merge the right sibling into this node
+                self.count_event("merges")
+                node.keys.append(parent.keys.pop(index))
+                node.keys.extend(right.keys)
+                node.children.extend(right.children)
+                node.size += right.size + 1
+                parent.children.pop(index + 1)
+
+        # an empty root with one child gives the tree one level less
+        if not self.root.keys and not self.root.leaf:
+            self.root = self.root.children[0]
+
+    def __len__(self):
+        return self.root.size
+
+    def enable_stats(self):
+        # start counting STAT_EVENTS from zero, costs one check per operation while off
+        self.counters = dict.fromkeys(STAT_EVENTS, 0)
+
+    def disable_stats(self):
+        self.counters = None
+
+    def count_event(self, event):
+        if self.counters is not None:
+            self.counters[event] += 1
+
+    def count_visit(self, node, passed):
+        # a node looked at on the way down, passed keys were stepped over
+        # and one more comparison stopped the scan (unless it ran off the end)
+        self.counters["nodes_visited"] += 1
+        self.counters["key_comparisons"] += passed + (passed < len(node.keys))
+
+    def stats(self):
+        # size and shape of the tree, plus the event counts when they are on
+        # node_fill is the share of key slots in use, over all nodes
+        height = 1
+        node = self.root
+        while not node.leaf:
+            node = node.children[0]
+            height += 1
+        nodes = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            stack.extend(node.children)
+        shape = {
+            "size": len(self),
+            "height": height,
+            "nodes": nodes,
+            "node_fill": round(len(self) / (nodes * (2 * self.order - 1)), 3),
+        }
+        return {**shape, **(self.counters or {})}
+
+    def count_below(self, key, or_equal=False):
+        # how many keys are < key (<= key if or_equal), one walk down using the sizes
+        count = 0
+        node = self.root
+        while True:
+            i = 0
+            while i < len(node.keys) and (node.keys[i][0] < key or (or_equal and node.keys[i][0] == key)):
+                if not node.leaf:
+                    count += node.children[i].size
+                count += 1
+                i += 1
+            if self.counters is not None:
+                self.count_visit(node, i)
+            if node.leaf:
+                return count
+            node = node.children[i]
+
+    def count_range(self, lo, hi, inclusive=True):
+        # how many keys range(lo, hi, inclusive) would give, without walking them
+        return max(0, self.count_below(hi, inclusive) - self.count_below(lo, not inclusive))
+
+    def select(self, i):
+        # (key, value) of the i-th entry in key order, counting from 0
+        if not 0 <= i < len(self):
+            raise IndexError("tree index out of range")
+        node = self.root
+        while not node.leaf:
+            self.count_event("nodes_visited")
+            for j, child in enumerate(node.children):
+                if i < child.size:
+                    node = child
+                    break
+                i -= child.size
+                if i == 0:
+                    return node.keys[j]
+                i -= 1
+        return node.keys[i]
+
+    def sample_range(self, lo, hi, k, inclusive=True):
+        # values of k different entries picked at random from range(lo, hi)
+        # (all of them if there are fewer), one select each
+        start = self.count_below(lo, not inclusive)
+        count = self.count_range(lo, hi, inclusive)
+        return [self.select(i)[1] for i in random.sample(range(start, start + count), min(k, count))]
+
+    def find_k_closest(self, key, k):
+        # values of the k entries with keys closest to key, closest first
+        # one seek to where key would go, then two cursors walk outwards and
+        # the nearer of the next smaller and next larger entry is taken each
+        # step (the smaller one on a tie), so O(log n + k)
+        after = self.cursor().seek(key)
+        before = self.cursor().seek(key)
+        below = before.prev()
+        above = after.next()
+        found = []
+        while len(found) < k and (below is not None or above is not None):
+            if above is None or (below is not None and key - below[0] <= above[0] - key):
+                found.append(below[1])
+                below = before.prev()
+            else:
+                found.append(above[1])
+                above = after.next()
+        return found
+
+    def find_closest(self, key):
+        # value with the closest key, the nearest key can sit in a sibling
+        # subtree of the search path, so walk outwards from the seek position
+        closest = self.find_k_closest(key, 1)
+        return closest[0] if closest else None
@@ -0,0 +1,41 @@
+import threading
+
+
+class BackgroundLoader:
+    # runs named loading steps one after another in a background thread, so
+    # the program can take input while the catalog and its indexes are built
+    # get(name) blocks only until that step is done, and raises the step's
+    # error (if it failed) in the caller's thread
+    def __init__(self, steps):
+        self.steps = steps  # [(name, function)], a step may get() earlier ones
+        self.results = {}
+        self.errors = {}
+        self.done = {name: threading.Event() for name, _ in steps}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        for name, function in self.steps:
+            try:
+                self.results[name] = function()
+            except Exception as error:  # handed to whoever waits for this step
+                self.errors[name] = error
+            self.done[name].set()
+
+    def ready(self, name):
+        return self.done[name].is_set()
+
+    def get(self, name):
+        self.done[name].wait()
+        if name in self.errors:
+            raise self.errors[name]
+        return self.results[name]
+
+    def set(self, name, value):
+        # replace a finished step's result, e.g. indexes rebuilt after an update
+        self.results[name] = value
+        self.errors.pop(name, None)
+        self.done[name].set()
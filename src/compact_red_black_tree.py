@@ -0,0 +1,334 @@
+from array import array
+
+NIL = -1  # index used for "no node"
+
+
+class CompactRedBlackTreeCursor:
+    # same as RedBlackTreeCursor, but the position is a node index
+    def __init__(self, tree):
+        self.tree = tree
+        self.node = tree.minimum(tree.root)  # entry right after the position, NIL at the end
+
+    def seek(self, key, inclusive=True):
+        # move to just before the first entry with key >= key (key > key if not inclusive)
+        tree = self.tree
+        node = tree.root
+        self.node = NIL
+        while node != NIL:
+            node_key = tree.keys[node]
+            if node_key > key or (inclusive and node_key == key):
+                self.node = node
+                node = tree.left[node]
+            else:
+                node = tree.right[node]
+        return self
+
+    def seek_end(self):
+        # move past the last entry, prev then walks backwards from the end
+        self.node = NIL
+        return self
+
+    def next(self):
+        # (key, value) after the position and step over it, None at the end
+        node = self.node
+        if node == NIL:
+            return None
+        self.node = self.tree.successor(node)
+        return self.tree.keys[node], self.tree.values[node]
+
+    def prev(self):
+        # (key, value) before the position and step back over it, None at the start
+        tree = self.tree
+        if tree is None:
+            return None
+        if self.node == NIL:
+            predecessor = tree.maximum(tree.root)
+        else:
+            predecessor = tree.predecessor(self.node)
+        if predecessor == NIL:
+            return None
+        self.node = predecessor
+        return tree.keys[predecessor], tree.values[predecessor]
+
+    def close(self):
+        # drop the reference to the tree, next and prev give None after this
+        self.tree = None
+        self.node = NIL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CompactRedBlackTree:
+    # red - black tree with the nodes stored as rows of parallel typed arrays
+    # instead of one python object each: float keys, int32 links, one color
+    # bit per node and an integer payload (the song's row id)
+    # same public api as RedBlackTree, but values have to be integers
+    def __init__(self):
+        self.keys = array('d')
+        self.values = array('q')
+        self.left = array('i')
+        self.right = array('i')
+        self.parent = array('i')
+        self.colors = bytearray()  # bit i is set when node i is red
+        self.root = NIL
+
+    def __len__(self):
+        return len(self.keys)
+
+    def is_red(self, node):
+        return node != NIL and (self.colors[node >> 3] >> (node & 7)) & 1 == 1
+
+    def set_red(self, node, red):
+        if red:
+            self.colors[node >> 3] |= 1 << (node & 7)
+        else:
+            self.colors[node >> 3] &= ~(1 << (node & 7)) & 0xFF
+
+    def new_node(self, key, value):
+        node = len(self.keys)
+        self.keys.append(key)
+        self.values.append(value)
+        self.left.append(NIL)
+        self.right.append(NIL)
+        self.parent.append(NIL)
+        if node & 7 == 0:
+            self.colors.append(0)
+        self.set_red(node, True)  # new is red
+        return node
+
+    @classmethod
+    def from_sorted(cls, items):
+        # build a balanced tree from (key, row id) pairs already sorted by key
+        # node i is the i-th item, so only the links need to be worked out
+        items = items if isinstance(items, list) else list(items)
+        tree = cls()
+        n = len(items)
+        if not n:
+            return tree
+        tree.keys = array('d', (key for key, _ in items))
+        tree.values = array('q', (value for _, value in items))
+        tree.left = array('i', [NIL]) * n
+        tree.right = array('i', [NIL]) * n
+        tree.parent = array('i', [NIL]) * n
+        tree.colors = bytearray((n + 7) // 8)
+
+        # nodes on an incomplete last level are red, like RedBlackTree.from_sorted
+        red_depth = n.bit_length() - 1 if n & (n + 1) else -1
+
+        def build(lo, hi, depth, parent):
+            if lo > hi:
+                return NIL
+            mid = (lo + hi + 1) // 2
+            tree.parent[mid] = parent
+            if depth == red_depth:
+                tree.set_red(mid, True)
+            tree.left[mid] = build(lo, mid - 1, depth + 1, mid)
+            tree.right[mid] = build(mid + 1, hi, depth + 1, mid)
+            return mid
+
+        tree.root = build(0, n - 1, 0, NIL)
+        return tree
+
+    def to_arrays(self):
+        # the node arrays, small to pickle, e.g. for a tree built in another process
+        return {
+            "keys": self.keys,
+            "values": self.values,
+            "left": self.left,
+            "right": self.right,
+            "parent": self.parent,
+            "colors": bytes(self.colors),
+            "root": self.root,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        tree = cls()
+        for name in ("keys", "values", "left", "right", "parent"):
+            setattr(tree, name, arrays[name])
+        tree.colors = bytearray(arrays["colors"])
+        tree.root = arrays["root"]
+        return tree
+
+    @classmethod
+    def bulk_load(cls, iterable):
+        # sort the (key, row id) pairs once, then build bottom up
+        return cls.from_sorted(sorted(iterable, key=lambda item: item[0]))
+
+    def minimum(self, node):
+        while node != NIL and self.left[node] != NIL:
+            node = self.left[node]
+        return node
+
+    def maximum(self, node):
+        while node != NIL and self.right[node] != NIL:
+            node = self.right[node]
+        return node
+
+    def successor(self, node):
+        if self.right[node] != NIL:
+            return self.minimum(self.right[node])
+        parent = self.parent[node]
+        while parent != NIL and node == self.right[parent]:
+            node, parent = parent, self.parent[parent]
+        return parent
+
+    def predecessor(self, node):
+        if self.left[node] != NIL:
+            return self.maximum(self.left[node])
+        parent = self.parent[node]
+        while parent != NIL and node == self.left[parent]:
+            node, parent = parent, self.parent[parent]
+        return parent
+
+    def cursor(self):
+        # cursor before the first entry, use seek to start somewhere else
+        return CompactRedBlackTreeCursor(self)
+
+    def __iter__(self):
+        # same walk as the cursor, with the arrays in locals
+        left, right, parent, values = self.left, self.right, self.parent, self.values
+        node = self.minimum(self.root)
+        while node != NIL:
+            yield values[node]
+            if right[node] != NIL:
+                node = right[node]
+                while left[node] != NIL:
+                    node = left[node]
+            else:
+                child, node = node, parent[node]
+                while node != NIL and child == right[node]:
+                    child, node = node, parent[node]
+
+    def __reversed__(self):
+        cursor = self.cursor().seek_end()
+        item = cursor.prev()
+        while item is not None:
+            yield item[1]
+            item = cursor.prev()
+
+    def range(self, lo, hi, inclusive=True):
+        # yield values with lo <= key <= hi (or lo < key < hi if not inclusive)
+        cursor = self.cursor().seek(lo, inclusive)
+        item = cursor.next()
+        while item is not None and (item[0] < hi or (inclusive and item[0] == hi)):
+            yield item[1]
+            item = cursor.next()
+
+    def insert(self, key, value):
+        new_node = self.new_node(key, value)
+        if self.root == NIL:
+            self.root = new_node
+            self.set_red(new_node, False)  # root is black
+            return
+
+        # BST insertion
+        parent = NIL
+        current = self.root
+        while current != NIL:
+            parent = current
+            if key < self.keys[current]:
+                current = self.left[current]
+            else:
+                current = self.right[current]
+
+        if key < self.keys[parent]:
+            self.left[parent] = new_node
+        else:
+            self.right[parent] = new_node
+        self.parent[new_node] = parent
+
+        self.fix_insert(new_node)
+
+    def fix_insert(self, node):
+        # fix after insert, same cases as RedBlackTree.fix_insert
+        parent_of = self.parent
+        while node != self.root and self.is_red(parent_of[node]):
+            parent = parent_of[node]
+            grandparent = parent_of[parent]
+            if parent == self.left[grandparent]:
+                uncle = self.right[grandparent]
+                if self.is_red(uncle):
+                    # red uncle
+                    self.set_red(parent, False)
+                    self.set_red(uncle, False)
+                    self.set_red(grandparent, True)
+                    node = grandparent
+                else:
+                    if node == self.right[parent]:
+                        # right child
+                        node = parent
+                        self.left_rotate(node)
+                    # left child
+                    parent = parent_of[node]
+                    self.set_red(parent, False)
+                    self.set_red(parent_of[parent], True)
+                    self.right_rotate(parent_of[parent])
+            else:
+                uncle = self.left[grandparent]
+                if self.is_red(uncle):
+                    self.set_red(parent, False)
+                    self.set_red(uncle, False)
+                    self.set_red(grandparent, True)
+                    node = grandparent
+                else:
+                    if node == self.left[parent]:
+                        node = parent
+                        self.right_rotate(node)
+                    parent = parent_of[node]
+                    self.set_red(parent, False)
+                    self.set_red(parent_of[parent], True)
+                    self.left_rotate(parent_of[parent])
+        self.set_red(self.root, False)
+
+    def left_rotate(self, node):
+        right_child = self.right[node]
+        self.right[node] = self.left[right_child]
+        if self.left[right_child] != NIL:
+            self.parent[self.left[right_child]] = node
+        parent = self.parent[node]
+        self.parent[right_child] = parent
+        if parent == NIL:
+            self.root = right_child
+        elif node == self.left[parent]:
+            self.left[parent] = right_child
+        else:
+            self.right[parent] = right_child
+        self.left[right_child] = node
+        self.parent[node] = right_child
+
+    def right_rotate(self, node):
+        left_child = self.left[node]
+        self.left[node] = self.right[left_child]
+        if self.right[left_child] != NIL:
+            self.parent[self.right[left_child]] = node
+        parent = self.parent[node]
+        self.parent[left_child] = parent
+        if parent == NIL:
+            self.root = left_child
+        elif node == self.right[parent]:
+            self.right[parent] = left_child
+        else:
+            self.left[parent] = left_child
+        self.right[left_child] = node
+        self.parent[node] = left_child
+
+    def find_closest(self, key):
+        # find node with closest key, same walk as RedBlackTree.find_closest
+        current = self.root
+        closest = NIL
+        closest_diff = float('inf')
+        while current != NIL:
+            diff = abs(self.keys[current] - key)
+            if diff < closest_diff:
+                closest = current
+                closest_diff = diff
+            if key < self.keys[current]:
+                current = self.left[current]
+            else:
+                current = self.right[current]
+        return self.values[closest] if closest != NIL else None
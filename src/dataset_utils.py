@@ -1,7 +1,44 @@
-import pandas as pd
+# pandas takes a while to import, so it is only imported by the functions
+# that read a csv, starting from a snapshot never loads it
+import numpy as np
+from src.genre_index import GenreIndex
+from src.kd_tree import KDTree
+from src.ngram_index import NgramIndex
+from src.query_planner import TableStats
+from src.snapshot import load_snapshot, save_snapshot
+from src.text_column import TextColumn
+
+# columns needed from the csv
+SONG_COLUMNS = ['track_name', 'artists', 'track_genre', 'tempo', 'popularity', 'danceability', 'valence', 'explicit']
+
+# dtypes to read them with, popularity is read as float since it may be missing
+SONG_DTYPES = {
+    'track_name': object,
+    'artists': object,
+    'track_genre': object,
+    'tempo': np.float64,
+    'popularity': np.float64,
+    'danceability': np.float64,
+    'valence': np.float64,
+    'explicit': bool,
+}
+
+# the per song arrays of a SongTable
+TABLE_ARRAYS = ['genre_codes', 'tempo', 'popularity', 'danceability', 'valence', 'explicit', 'deleted']
+
+# dictionary encoded text columns of a SongTable
+TEXT_COLUMNS = ['track_name', 'artists']
+
+# rows read from the csv at a time
+CHUNK_SIZE = 50_000
+
+# numeric filters that take a (low, high) band
+BAND_COLUMNS = ['danceability', 'valence', 'popularity', 'tempo']
+
 
 def load_song_dataset(filepath="dataset/songs_dataset.csv"):
     # load the data set
+    import pandas as pd
 
     # try to read dataset
     try:
@@ -12,8 +49,444 @@ def load_song_dataset(filepath="dataset/songs_dataset.csv"):
         return []
 
     # columns needed
-    df = df[['track_name', 'artists', 'track_genre', 'tempo', 'popularity', 'danceability', 'valence', 'explicit']]
+    df = df[SONG_COLUMNS]
 
     print(f"Loaded dataset with {len(df)} songs.")
     return df.to_dict(orient="records")
 
+
+def load_song_table(filepath="dataset/songs_dataset.csv", use_snapshot=True):
+    # load the data set into a column store instead of a list of dicts
+    # with use_snapshot the table and its indexes are memory mapped from the
+    # snapshot next to the csv, which is (re)written whenever it is missing or stale
+    if use_snapshot:
+        entries = load_snapshot(filepath)
+        if entries is not None:
+            table = SongTable.from_arrays(entries["table"])
+            restore_indexes(table, entries["indexes"])
+            print(f"Loaded dataset with {len(table)} songs from snapshot.")
+            return table
+
+    # the csv is read in chunks so only one chunk is ever held as a data frame
+    builder = SongTableBuilder()
+    try:
+        for chunk in iter_song_batches(filepath):
+            builder.add(chunk)
+    except FileNotFoundError:
+        print(f"Error: File not found at {filepath}")
+        table = SongTableBuilder().finish()
+        build_indexes(table)
+        return table
+
+    table = builder.finish()
+    print(f"Loaded dataset with {len(table)} songs.")
+    build_indexes(table)
+
+    if use_snapshot:
+        try:
+            save_snapshot(filepath, {"table": table.to_arrays(), "indexes": index_arrays(table)})
+        except OSError as error:
+            print(f"Warning: could not write snapshot ({error})")
+    return table
+
+
+def iter_song_batches(filepath="dataset/songs_dataset.csv", chunk_size=CHUNK_SIZE):
+    # yield data frames of at most chunk_size rows, with only the needed columns
+    import pandas as pd
+    with pd.read_csv(filepath, usecols=SONG_COLUMNS, dtype=SONG_DTYPES, chunksize=chunk_size) as reader:
+        yield from reader
+
+
+class SongTableBuilder:
+    # collects chunks from iter_song_batches into the arrays of a SongTable
+    # text is interned as it comes in, so repeated strings are only kept once
+    def __init__(self):
+        self.text_lookup = {"track_name": {}, "artists": {}, "track_genre": {}}
+        self.chunks = {column: [] for column in SONG_COLUMNS}
+
+    def intern(self, column, values):
+        # codes into self.text_lookup[column], -1 for missing values
+        import pandas as pd
+        codes, uniques = pd.factorize(values)
+        lookup = self.text_lookup[column]
+        ids = np.array([lookup.setdefault(value, len(lookup)) for value in uniques], dtype=np.int32)
+        return np.where(codes >= 0, ids[codes] if len(ids) else -1, -1).astype(np.int32)
+
+    def add(self, chunk):
+        for column in self.text_lookup:
+            self.chunks[column].append(self.intern(column, chunk[column]))
+        self.chunks['tempo'].append(chunk['tempo'].to_numpy(dtype=np.float64))
+        self.chunks['popularity'].append(chunk['popularity'].fillna(0).to_numpy(dtype=np.int16))
+        self.chunks['danceability'].append(chunk['danceability'].to_numpy(dtype=np.float64))
+        self.chunks['valence'].append(chunk['valence'].to_numpy(dtype=np.float64))
+        self.chunks['explicit'].append(chunk['explicit'].to_numpy(dtype=bool))
+
+    def column(self, name, dtype):
+        parts = self.chunks[name]
+        self.chunks[name] = []  # let the chunk arrays go as soon as they are joined
+        return np.concatenate(parts).astype(dtype, copy=False) if parts else np.empty(0, dtype=dtype)
+
+    def finish(self):
+        # genres get sorted codes, the same order the genre list is shown in
+        genres = sorted(self.text_lookup['track_genre'], key=str)
+        new_codes = np.array([genres.index(genre) for genre in self.text_lookup['track_genre']] + [-1], dtype=np.int16)
+        genre_codes = new_codes[self.column('track_genre', np.int32)]
+
+        return SongTable(
+            track_name=TextColumn(self.column('track_name', np.int32), list(self.text_lookup['track_name'])),
+            artists=TextColumn(self.column('artists', np.int32), list(self.text_lookup['artists'])),
+            genres=[str(genre) for genre in genres],
+            genre_codes=genre_codes,
+            tempo=self.column('tempo', np.float64),
+            popularity=self.column('popularity', np.int16),
+            danceability=self.column('danceability', np.float64),
+            valence=self.column('valence', np.float64),
+            explicit=self.column('explicit', bool),
+        )
+
+
+def build_indexes(table):
+    # secondary indexes kept on the table, built once at load
+    table.dance_order = np.argsort(table.danceability, kind="stable")
+    table.genre_index = GenreIndex(table)
+    table.text_indexes = {
+        "track_name": NgramIndex(table.track_name),
+        "artists": NgramIndex(table.artists),
+    }
+    table.kd_tree = KDTree(table)
+    table.set_song_ids(song_copies(table))
+    table.column_stats = TableStats(table)
+
+
+def song_copies(table):
+    # canonical row of every row: the first live row with the same title and
+    # artist, so the copies of a track listed under several genres share an id
+    # removed rows get -1
+    live = np.flatnonzero(~table.deleted)
+    _, first, inverse = np.unique(table.song_keys(live), return_index=True, return_inverse=True)
+    song_ids = np.full(len(table), -1, dtype=np.int32)
+    song_ids[live] = live[first][inverse.reshape(-1)]
+    return song_ids
+
+
+def index_arrays(table):
+    # flat arrays of every index, for the snapshot
+    return {
+        "dance_order": table.dance_order,
+        "genre_index": table.genre_index.to_arrays(),
+        "text_indexes": {column: index.to_arrays() for column, index in table.text_indexes.items()},
+        "kd_tree": table.kd_tree.to_arrays(),
+        "song_ids": table.song_ids,
+    }
+
+
+def restore_indexes(table, arrays):
+    # opposite of index_arrays
+    table.dance_order = arrays["dance_order"]
+    table.genre_index = GenreIndex.from_arrays(table, arrays["genre_index"])
+    table.text_indexes = {column: NgramIndex.from_arrays(index) for column, index in arrays["text_indexes"].items()}
+    table.kd_tree = KDTree.from_arrays(table, arrays["kd_tree"])
+    table.set_song_ids(arrays["song_ids"])
+    table.column_stats = TableStats(table)
+
+
+def delta_value(column, value):
+    # a cell of a delta csv as the type the table keeps it in
+    if column in ('track_name', 'artists', 'track_genre'):
+        return value
+    if column == 'explicit':
+        return value.strip().lower() in ("true", "1")
+    if column == 'popularity':
+        return int(float(value))
+    return float(value)
+
+
+def apply_song_delta(table, trees, filepath):
+    # apply a delta csv to the table, its indexes and the danceability trees
+    # (holding row ids) in place, instead of reloading everything
+    # the csv has a change column (add, remove or update), a row column with
+    # the song's row id for remove and update, and any of SONG_COLUMNS, blank
+    # cells in an update keep the old value
+    # every line is read and checked before anything changes, so a bad cell
+    # (raised as a ValueError) leaves the table and trees as they were
+    import pandas as pd
+    delta = pd.read_csv(filepath, dtype=str)
+    counts = {"add": 0, "remove": 0, "update": 0, "skipped": 0}
+    added = []
+    changes = []  # (kind, row, values) for removes and updates, in file order
+    removing = set()
+
+    for line_number, change in enumerate(delta.to_dict(orient="records"), start=2):
+        kind = str(change.get("change", "")).strip().lower()
+        try:
+            values = {column: delta_value(column, change[column]) for column in SONG_COLUMNS if isinstance(change.get(column), str)}
+        except ValueError as error:
+            raise ValueError(f"line {line_number}: {error}") from error
+        if kind == "add":
+            added.append(values)
+            continue
+
+        try:
+            row = int(float(change.get("row")))
+        except (TypeError, ValueError):
+            row = -1
+        if kind not in ("remove", "update") or not 0 <= row < len(table) or table.deleted[row] or row in removing:
+            counts["skipped"] += 1
+            continue
+        if kind == "remove":
+            removing.add(row)
+        changes.append((kind, row, values))
+        counts[kind] += 1
+
+    table.make_writable()
+    for kind, row, values in changes:
+        if kind == "remove":
+            remove_song(table, trees, row)
+        else:
+            update_song(table, trees, row, values)
+
+    # new songs are appended in one go, then indexed one by one
+    if added:
+        rows = table.append_rows(added)
+        table.kd_tree.add_rows(rows)
+        for row in rows:
+            for tree in trees:
+                tree.insert(float(table.danceability[row]), row)
+            table.genre_index.add_row(row, table.genre_codes[row])
+            for column, index in table.text_indexes.items():
+                index.set_row(row, getattr(table, column)[row])
+        counts["add"] = len(added)
+    for column, index in table.text_indexes.items():
+        if index.needs_rebuild():
+            table.text_indexes[column] = NgramIndex(getattr(table, column), table.deleted)
+    table.set_song_ids(song_copies(table))  # new songs, changed titles and removed first copies
+    table.column_stats = TableStats(table)
+    table.version += 1
+    return counts
+
+
+def remove_song(table, trees, row):
+    for tree in trees:
+        tree.delete(float(table.danceability[row]), row)
+    table.genre_index.remove_row(row, table.genre_codes[row])
+    for index in table.text_indexes.values():
+        index.set_row(row, None)
+    table.deleted[row] = True  # the k-d tree skips deleted rows
+
+
+def update_song(table, trees, row, values):
+    old_danceability = float(table.danceability[row])
+    old_genre = table.genre_codes[row]
+    table.set_values(row, values)
+
+    new_danceability = float(table.danceability[row])
+    if new_danceability != old_danceability:
+        for tree in trees:
+            tree.update(old_danceability, row, new_danceability)
+    if table.genre_codes[row] != old_genre:
+        table.genre_index.move_row(row, old_genre, table.genre_codes[row])
+    for column, index in table.text_indexes.items():
+        if column in values:
+            index.set_row(row, getattr(table, column)[row])
+    if any(column in values for column in ('danceability', 'valence', 'popularity')):
+        table.kd_tree.move_point(row)
+
+
+class SongTable:
+    # songs stored as one array per column, row i of every array is the same song
+    # the trees hold row ids into this table instead of dicts
+    def __init__(self, track_name, artists, genres, genre_codes, tempo, popularity, danceability, valence, explicit):
+        self.track_name = track_name  # TextColumns, codes into the distinct strings
+        self.artists = artists
+        self.genres = genres  # sorted genre names, genre_codes index into it
+        self.genre_codes = genre_codes  # -1 when the genre is missing
+        self.tempo = tempo
+        self.popularity = popularity
+        self.danceability = danceability
+        self.valence = valence
+        self.explicit = explicit
+        self.deleted = np.zeros(len(danceability), dtype=bool)  # set for songs removed by a delta
+        self.version = 0  # goes up when a delta is applied, for cached results
+
+        # indexes, set up by build_indexes or restored from a snapshot
+        self.dance_order = None  # row ids sorted by danceability, what the trees are built from
+        self.genre_index = None
+        self.text_indexes = {}  # column name -> NgramIndex
+        self.kd_tree = None
+        self.song_ids = None  # canonical row of each row, shared by copies of the same song
+        self.variant_ids = None  # canonical row among copies with the same filtered values, see song_variants
+        self.first_variant = None  # True where a row is its variant's canonical row
+        self.copy_order = None  # live rows sorted by song id, made when copies_of is first used
+        self.copy_keys = None  # song id of each row of copy_order
+        self.column_stats = None  # TableStats for the query planner
+
+        # lowercase genre name -> codes, filters hold lowercase names
+        self.genre_lookup = {}
+        for code, genre in enumerate(self.genres):
+            self.genre_lookup.setdefault(genre.lower(), []).append(code)
+
+    def to_arrays(self):
+        # the columns as arrays and string lists, for the snapshot
+        return {
+            "track_name_codes": self.track_name.codes,
+            "track_name_values": self.track_name.values,
+            "artists_codes": self.artists.codes,
+            "artists_values": self.artists.values,
+            "genres": self.genres,
+            "genre_codes": self.genre_codes,
+            "tempo": self.tempo,
+            "popularity": self.popularity,
+            "danceability": self.danceability,
+            "valence": self.valence,
+            "explicit": self.explicit,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            track_name=TextColumn(arrays["track_name_codes"], arrays["track_name_values"]),
+            artists=TextColumn(arrays["artists_codes"], arrays["artists_values"]),
+            genres=arrays["genres"],
+            genre_codes=arrays["genre_codes"],
+            tempo=arrays["tempo"],
+            popularity=arrays["popularity"],
+            danceability=arrays["danceability"],
+            valence=arrays["valence"],
+            explicit=arrays["explicit"],
+        )
+
+    def __len__(self):
+        return len(self.danceability)
+
+    def genre_name(self, row):
+        code = self.genre_codes[row]
+        return self.genres[code] if code >= 0 else ""
+
+    def record(self, row):
+        # one song as a dict, same shape as load_song_dataset gives
+        return {
+            "track_name": self.track_name[row],
+            "artists": self.artists[row],
+            "track_genre": self.genre_name(row),
+            "tempo": float(self.tempo[row]),
+            "popularity": int(self.popularity[row]),
+            "danceability": float(self.danceability[row]),
+            "valence": float(self.valence[row]),
+            "explicit": bool(self.explicit[row]),
+        }
+
+    def make_writable(self):
+        # columns memory mapped from a snapshot are read only, copy them before changing
+        for column in TABLE_ARRAYS:
+            values = getattr(self, column)
+            if not values.flags.writeable:
+                setattr(self, column, np.array(values))
+        for column in TEXT_COLUMNS:
+            getattr(self, column).make_writable()
+
+    def genre_code(self, genre):
+        # code of a genre name, a genre not seen before is added to the end
+        if not isinstance(genre, str) or not genre:
+            return -1
+        if genre in self.genres:
+            return self.genres.index(genre)
+        self.genres.append(genre)
+        self.genre_lookup.setdefault(genre.lower(), []).append(len(self.genres) - 1)
+        return len(self.genres) - 1
+
+    def set_values(self, row, values):
+        # change some columns of one song, values maps column name -> new value
+        for column, value in values.items():
+            if column == 'track_genre':
+                self.genre_codes[row] = self.genre_code(value)
+            elif column in TEXT_COLUMNS:
+                getattr(self, column).set(row, value)
+            else:
+                getattr(self, column)[row] = value
+
+    def append_rows(self, songs):
+        # add songs (dicts of column -> value) at the end, returns their row ids
+        # missing text is left empty and missing numbers are 0
+        start = len(self)
+        for column in TEXT_COLUMNS:
+            getattr(self, column).append([song.get(column) for song in songs])
+        codes = np.array([self.genre_code(song.get('track_genre')) for song in songs], dtype=self.genre_codes.dtype)
+        self.genre_codes = np.concatenate((self.genre_codes, codes))
+        for column in ('tempo', 'popularity', 'danceability', 'valence', 'explicit'):
+            values = getattr(self, column)
+            added = np.array([song.get(column, 0) for song in songs], dtype=values.dtype)
+            setattr(self, column, np.concatenate((values, added)))
+        self.deleted = np.concatenate((self.deleted, np.zeros(len(songs), dtype=bool)))
+        return range(start, len(self))
+
+    def set_song_ids(self, song_ids):
+        self.song_ids = song_ids
+        self.variant_ids = None
+        self.first_variant = None
+        self.copy_order = None
+        self.copy_keys = None
+
+    def song_variants(self):
+        # canonical row of every row among the copies of its song that have
+        # the same value in every column a filter checks (all but the genre),
+        # so filtering that one row gives the answer for all of them
+        # gives (variant ids, first variant mask), removed rows get id -1,
+        # worked out on first use
+        if self.variant_ids is None:
+            live = np.flatnonzero(~self.deleted)
+            columns = [self.song_ids[live]] + [getattr(self, column)[live] for column in BAND_COLUMNS + ['explicit']]
+            keys = np.column_stack([values.astype(np.float64) for values in columns])
+            _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+            self.variant_ids = np.full(len(self), -1, dtype=np.int32)
+            self.variant_ids[live] = live[first][inverse.reshape(-1)]
+            self.first_variant = self.variant_ids == np.arange(len(self))
+        return self.variant_ids, self.first_variant
+
+    def copies_of(self, rows):
+        # every live copy of the song of each row, as a list of row id arrays in row order
+        if self.copy_order is None:
+            self.copy_order = np.argsort(self.song_ids, kind="stable")
+            self.copy_keys = self.song_ids[self.copy_order]
+        song_ids = self.song_ids[rows]
+        starts = np.searchsorted(self.copy_keys, song_ids).tolist()
+        ends = np.searchsorted(self.copy_keys, song_ids, side="right").tolist()
+        return [self.copy_order[start:end] for start, end in zip(starts, ends)]
+
+    def song_keys(self, rows):
+        # one int per row made from the title and artist codes, equal keys are the same song
+        return (self.track_name.codes[rows].astype(np.int64) << 32) | (self.artists.codes[rows].astype(np.int64) & 0xFFFFFFFF)
+
+    def unique_songs(self, rows):
+        # rows (an array of row ids) with later copies of a song left out, order kept
+        _, first = np.unique(self.song_ids[rows], return_index=True)
+        return rows[np.sort(first)]
+
+    def genre_codes_for(self, genres):
+        # codes of the genres named in a filter, unknown names are skipped
+        codes = []
+        for genre in genres:
+            codes.extend(self.genre_lookup.get(genre, []))
+        return np.array(codes, dtype=np.int16)
+
+    def filter_mask(self, filters, rows=None):
+        # turn a filter dict from ask_user_questions into one boolean mask
+        # over rows (an array of row ids), or over the whole table
+        if rows is None:
+            rows = slice(None)
+            mask = np.ones(len(self), dtype=bool)
+        else:
+            mask = np.ones(len(rows), dtype=bool)
+
+        if filters.get("genres"):
+            mask &= np.isin(self.genre_codes[rows], self.genre_codes_for(filters["genres"]))
+
+        if filters.get("explicit") is not None:
+            mask &= self.explicit[rows] == filters["explicit"]
+
+        for column in BAND_COLUMNS:
+            band = filters.get(column)
+            if band:
+                values = getattr(self, column)[rows]
+                mask &= (values >= band[0]) & (values <= band[1])
+
+        return mask
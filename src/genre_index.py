@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class GenreIndex:
+    # inverted index over the genre column of a SongTable
+    # each genre has a posting list with the sorted row ids of its songs
+    def __init__(self, table):
+        # one stable sort groups the rows by genre, rows stay sorted per genre
+        order = np.argsort(table.genre_codes, kind="stable")
+        bounds = np.searchsorted(table.genre_codes[order], np.arange(len(table.genres) + 1))
+        self.set_arrays(table, order, bounds)
+
+    def set_arrays(self, table, order, bounds):
+        self.genre_lookup = table.genre_lookup  # lowercase genre name -> codes
+        self.row_count = len(table)
+        self.order = order
+        self.bounds = bounds
+        self.postings = [order[bounds[code]:bounds[code + 1]] for code in range(len(bounds) - 1)]
+
+        # genre groups get asked for over and over, so keep their unions
+        self.group_cache = {}
+
+    def to_arrays(self):
+        # everything needed to rebuild the index, for the snapshot
+        # taken from the posting lists, which may have changed since loading
+        sizes = [len(posting) for posting in self.postings]
+        order = np.concatenate(self.postings) if self.postings else np.empty(0, dtype=np.int64)
+        return {"order": order, "bounds": np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)}
+
+    def add_row(self, row, code):
+        # put a new or changed song into its genre's posting list
+        if row >= self.row_count:
+            # masks cover every row, even ones without a genre, cached ones are now too short
+            self.row_count = row + 1
+            self.group_cache.clear()
+        if code < 0:
+            return
+        while code >= len(self.postings):
+            self.postings.append(np.empty(0, dtype=np.int64))
+        posting = self.postings[code]
+        self.postings[code] = np.insert(posting, np.searchsorted(posting, row), row)
+        self.group_cache.clear()
+
+    def remove_row(self, row, code):
+        if code < 0:
+            return
+        posting = self.postings[code]
+        position = np.searchsorted(posting, row)
+        if position < len(posting) and posting[position] == row:
+            self.postings[code] = np.delete(posting, position)
+            self.group_cache.clear()
+
+    def move_row(self, row, old_code, new_code):
+        # a song's genre changed
+        self.remove_row(row, old_code)
+        self.add_row(row, new_code)
+
+    @classmethod
+    def from_arrays(cls, table, arrays):
+        index = cls.__new__(cls)
+        index.set_arrays(table, **arrays)
+        return index
+
+    def group_key(self, genres):
+        return tuple(sorted(set(genres)))
+
+    def lookup_group(self, genres):
+        # (sorted row ids, row mask) for a list of lowercase genre names
+        key = self.group_key(genres)
+        cached = self.group_cache.get(key)
+        if cached is None:
+            lists = [self.postings[code] for genre in key for code in self.genre_lookup.get(genre, [])]
+            rows = np.sort(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+            mask = np.zeros(self.row_count, dtype=bool)
+            mask[rows] = True
+            cached = (rows, mask)
+            self.group_cache[key] = cached
+        return cached
+
+    def rows_for(self, genres):
+        # sorted row ids of every song in any of the genres
+        return self.lookup_group(genres)[0]
+
+    def mask_for(self, genres):
+        # boolean array over all rows, True for songs in any of the genres
+        return self.lookup_group(genres)[1]
+
+    def song_mask_for(self, genres, song_ids):
+        # boolean array over all rows, True at the canonical row (song_ids is
+        # SongTable.song_ids or the ids of SongTable.song_variants) of every
+        # song with a copy in any of the genres
+        mask = np.zeros(self.row_count, dtype=bool)
+        mask[song_ids[self.rows_for(genres)]] = True
+        return mask
+
+    def count(self, genres):
+        return len(self.rows_for(genres))
@@ -0,0 +1,89 @@
+import multiprocessing
+import numpy as np
+from src.compact_red_black_tree import CompactRedBlackTree
+
+MISSING_GENRE = -1  # shard for songs without a genre
+
+# below this many songs a pool costs more than it saves
+PARALLEL_MIN_ROWS = 50_000
+
+
+def pool_context():
+    # forkserver where the platform has it, otherwise spawn
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def build_shard(job):
+    # runs in a worker: sort one genre's rows by danceability and build its
+    # tree, the tree goes back as flat arrays which are cheap to pickle
+    code, rows, danceability = job
+    order = np.argsort(danceability, kind="stable")
+    tree = CompactRedBlackTree.from_sorted(list(zip(danceability[order].tolist(), rows[order].tolist())))
+    return code, tree.to_arrays()
+
+
+class GenreShards:
+    # the catalog split by genre, one danceability tree per genre
+    # a query only searches the shards of the genres it asks for and merges
+    # their rows, queries without genres go to every shard
+    def __init__(self, table, shards):
+        self.table = table
+        self.shards = shards  # genre code -> CompactRedBlackTree of (danceability, row id)
+        self.version = 0
+        self.shards_searched = 0  # total over all queries, shows unrelated shards are skipped
+
+    @classmethod
+    def build(cls, table, workers=None):
+        # one job per genre, biggest first so the pool finishes evenly
+        jobs = []
+        for code, posting in enumerate(table.genre_index.postings):
+            if len(posting):
+                jobs.append((code, posting, table.danceability[posting]))
+        missing = np.flatnonzero((table.genre_codes == MISSING_GENRE) & ~table.deleted)
+        if len(missing):
+            jobs.append((MISSING_GENRE, missing, table.danceability[missing]))
+        jobs.sort(key=lambda job: len(job[1]), reverse=True)
+
+        workers = workers or multiprocessing.cpu_count()
+        if workers > 1 and len(table) >= PARALLEL_MIN_ROWS:
+            # main() builds the shards in a background thread while the menu
+            # waits in input(), and a worker forked from there hangs on the
+            # stdin lock, so the workers start from a fresh process instead
+            with pool_context().Pool(workers) as pool:
+                built = pool.map(build_shard, jobs, chunksize=1)
+        else:
+            built = map(build_shard, jobs)
+        return cls(table, {code: CompactRedBlackTree.from_arrays(arrays) for code, arrays in built})
+
+    def shard_codes(self, genres):
+        # codes of the shards a genre list needs, every shard without genres
+        # genre groups can share a genre, each shard is still searched once
+        if not genres:
+            return list(self.shards)
+        codes = []
+        for genre in genres:
+            codes.extend(code for code in self.table.genre_lookup.get(genre, []) if code in self.shards)
+        return list(dict.fromkeys(codes))
+
+    def rows_for(self, filters):
+        # row ids in the requested genres and danceability band, merged from
+        # the shards and sorted by danceability like a single tree gives them
+        codes = self.shard_codes(filters.get("genres"))
+        self.shards_searched += len(codes)
+        found = []
+        for code in codes:
+            tree = self.shards[code]
+            if filters.get("danceability"):
+                low, high = filters["danceability"]
+                found.append(np.fromiter(tree.range(low, high), dtype=np.int64))
+            else:
+                found.append(np.frombuffer(tree.values, dtype=np.int64))
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(found)
+        return rows[np.argsort(self.table.danceability[rows], kind="stable")]
+
+    def stats(self):
+        return {"shards": len(self.shards), "size": sum(len(tree) for tree in self.shards.values()),
+                "shards_searched": self.shards_searched}
@@ -0,0 +1,233 @@
+from heapq import heappush, heappop
+import numpy as np
+
+# the playlist bands the tree is split on
+KD_COLUMNS = ['danceability', 'valence', 'popularity']
+
+
+def column_points(table, columns):
+    # one row of floats per song, one column per feature
+    return np.column_stack([getattr(table, column).astype(np.float64) for column in columns])
+
+
+def column_scale(points):
+    # overall range of each column, 1 where a column has only one value
+    if not len(points):
+        return np.ones(points.shape[1])
+    spread = points.max(axis=0) - points.min(axis=0)
+    return np.where(spread > 0, spread, 1.0)
+
+
+class KDTree:
+    # static k-d tree over danceability, valence and popularity of a SongTable
+    # (or other numeric columns), nodes live in flat arrays, each node covers
+    # a slice of self.rows
+    def __init__(self, table, leaf_size=32, columns=KD_COLUMNS):
+        self.table = table
+        self.leaf_size = leaf_size
+        self.columns = columns
+        self.points = column_points(table, columns)
+        self.rows = np.arange(len(table))
+
+        # per node: slice of self.rows, children (-1 for a leaf) and bounding box
+        self.start = []
+        self.end = []
+        self.left = []
+        self.right = []
+        self.box_low = []
+        self.box_high = []
+
+        # popularity is 0 - 100 and the rest 0 - 1, so compare spreads relative
+        # to each column's overall range when picking the split column
+        self.scale = column_scale(self.points)
+        if len(table):
+            self.build()
+        self.box_low = np.array(self.box_low).reshape(-1, len(columns))
+        self.box_high = np.array(self.box_high).reshape(-1, len(columns))
+        self.reset_updates()
+
+    def reset_updates(self):
+        # rows added after the build are not in any node, queries check them one by one
+        self.extra_rows = np.empty(0, dtype=np.int64)
+        self.leaf_of_row = None  # set up on the first move_point
+        self.parent = None
+
+    def to_arrays(self):
+        # everything needed to rebuild the tree, for the snapshot
+        return {
+            "rows": self.rows,
+            "start": np.array(self.start, dtype=np.int64),
+            "end": np.array(self.end, dtype=np.int64),
+            "left": np.array(self.left, dtype=np.int64),
+            "right": np.array(self.right, dtype=np.int64),
+            "box_low": self.box_low,
+            "box_high": self.box_high,
+        }
+
+    @classmethod
+    def from_arrays(cls, table, arrays, leaf_size=32):
+        tree = cls.__new__(cls)
+        tree.table = table
+        tree.leaf_size = leaf_size
+        tree.columns = KD_COLUMNS
+        tree.points = column_points(table, KD_COLUMNS)
+        tree.scale = column_scale(tree.points)
+        tree.rows = arrays["rows"]
+        tree.box_low = arrays["box_low"]
+        tree.box_high = arrays["box_high"]
+        # the query loop indexes these one node at a time, lists are faster for that
+        for name in ("start", "end", "left", "right"):
+            setattr(tree, name, np.asarray(arrays[name]).tolist())
+        tree.reset_updates()
+        return tree
+
+    def add_rows(self, rows):
+        # songs appended to the table after the tree was built
+        self.points = column_points(self.table, self.columns)
+        self.extra_rows = np.concatenate((self.extra_rows, np.asarray(rows, dtype=np.int64)))
+
+    def move_point(self, row):
+        # a song's danceability, valence or popularity changed
+        # the boxes on the way up to the root grow to cover the new point,
+        # which keeps every query correct without rebuilding
+        point = np.array([getattr(self.table, column)[row] for column in self.columns], dtype=np.float64)
+        self.points[row] = point
+        if row in self.extra_rows:
+            return
+
+        if self.leaf_of_row is None:
+            self.leaf_of_row = np.empty(len(self.rows), dtype=np.int64)
+            self.parent = [-1] * len(self.start)
+            for node in range(len(self.start)):
+                if self.left[node] == -1:
+                    self.leaf_of_row[self.rows[self.start[node]:self.end[node]]] = node
+                else:
+                    self.parent[self.left[node]] = node
+                    self.parent[self.right[node]] = node
+            # boxes may be memory mapped from a snapshot, take a copy to change
+            self.box_low = np.array(self.box_low)
+            self.box_high = np.array(self.box_high)
+
+        node = int(self.leaf_of_row[row])
+        while node != -1:
+            np.minimum(self.box_low[node], point, out=self.box_low[node])
+            np.maximum(self.box_high[node], point, out=self.box_high[node])
+            node = self.parent[node]
+
+    def new_node(self, start, end):
+        points = self.points[self.rows[start:end]]
+        self.start.append(start)
+        self.end.append(end)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.box_low.append(points.min(axis=0))
+        self.box_high.append(points.max(axis=0))
+        return len(self.start) - 1
+
+    def build(self):
+        # split on the median of the widest column until slices are leaf sized
+        stack = [self.new_node(0, len(self.rows))]
+        while stack:
+            node = stack.pop()
+            start, end = self.start[node], self.end[node]
+            if end - start <= self.leaf_size:
+                continue
+            column = int(np.argmax((self.box_high[node] - self.box_low[node]) / self.scale))
+            if self.box_high[node][column] == self.box_low[node][column]:
+                continue  # every point is the same, nothing to split
+
+            mid = (end - start) // 2
+            segment = self.rows[start:end]
+            order = np.argpartition(self.points[segment, column], mid)
+            self.rows[start:end] = segment[order]
+
+            self.left[node] = self.new_node(start, start + mid)
+            self.right[node] = self.new_node(start + mid, end)
+            stack.append(self.left[node])
+            stack.append(self.right[node])
+
+    def query_box(self, low, high, tempo=None, explicit=None):
+        # sorted row ids with low <= (danceability, valence, popularity) <= high
+        # tempo is an optional (low, high) band and explicit an optional bool
+        low = np.asarray(low, dtype=np.float64)
+        high = np.asarray(high, dtype=np.float64)
+        found = []
+        stack = [0] if len(self.start) else []
+        while stack:
+            node = stack.pop()
+            node_low, node_high = self.box_low[node], self.box_high[node]
+            if (node_high < low).any() or (node_low > high).any():
+                continue  # box and node do not overlap
+            rows = self.rows[self.start[node]:self.end[node]]
+            if (node_low >= low).all() and (node_high <= high).all():
+                found.append(rows)  # node is fully inside the box
+            elif self.left[node] == -1:
+                points = self.points[rows]
+                found.append(rows[((points >= low) & (points <= high)).all(axis=1)])
+            else:
+                stack.append(self.left[node])
+                stack.append(self.right[node])
+
+        if len(self.extra_rows):
+            points = self.points[self.extra_rows]
+            found.append(self.extra_rows[((points >= low) & (points <= high)).all(axis=1)])
+
+        rows = np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+        rows = rows[~self.table.deleted[rows]]
+        if tempo:
+            tempos = self.table.tempo[rows]
+            rows = rows[(tempos >= tempo[0]) & (tempos <= tempo[1])]
+        if explicit is not None:
+            rows = rows[self.table.explicit[rows] == explicit]
+        return rows
+
+    def nearest(self, point, k, mask=None):
+        # the k rows closest to point, with each column divided by its overall
+        # range so they all count the same, mask (one bool per row) limits
+        # which rows can be picked
+        # gives (rows, squared distances), nearest first
+        point = np.asarray(point, dtype=np.float64)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0)
+        if k <= 0:
+            return best_rows, best_distances
+
+        def keep_best(rows, distances):
+            rows = np.concatenate((best_rows, rows))
+            distances = np.concatenate((best_distances, distances))
+            if len(rows) > k:
+                keep = np.argpartition(distances, k - 1)[:k]
+                rows, distances = rows[keep], distances[keep]
+            return rows, distances
+
+        def candidates(rows):
+            rows = rows[~self.table.deleted[rows]]
+            if mask is not None:
+                rows = rows[mask[rows]]
+            return rows, (((self.points[rows] - point) / self.scale) ** 2).sum(axis=1)
+
+        if len(self.extra_rows):
+            best_rows, best_distances = keep_best(*candidates(self.extra_rows))
+
+        # nodes are opened closest box first, and the search stops once the
+        # next box is further away than the k-th best row found so far
+        frontier = [(0.0, 0)] if len(self.start) else []
+        while frontier:
+            box_distance, node = heappop(frontier)
+            if len(best_rows) == k and box_distance > best_distances.max():
+                break
+            if self.left[node] == -1:
+                best_rows, best_distances = keep_best(*candidates(self.rows[self.start[node]:self.end[node]]))
+                continue
+            for child in (self.left[node], self.right[node]):
+                gap = np.maximum(self.box_low[child] - point, 0) + np.maximum(point - self.box_high[child], 0)
+                heappush(frontier, (float(((gap / self.scale) ** 2).sum()), child))
+
+        order = np.argsort(best_distances, kind="stable")
+        return best_rows[order], best_distances[order]
+
+    def rows_for(self, filters):
+        # run the box query for a filter dict from ask_user_questions
+        low = [filters[column][0] if filters.get(column) else -np.inf for column in KD_COLUMNS]
+        high = [filters[column][1] if filters.get(column) else np.inf for column in KD_COLUMNS]
+        return self.query_box(low, high, tempo=filters.get("tempo"), explicit=filters.get("explicit"))
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+import numpy as np
+
+GRAM_SIZE = 3
+# padding at the end so every position in a string starts a full gram
+PADDING = "\x00" * (GRAM_SIZE - 1)
+# share of the rows that may be overridden before the index is built again,
+# every search checks the overrides one by one
+REBUILD_SHARE = 0.02
+
+
+def search_text(value):
+    # make strings, all lowercase, so they can be compared
+    return str(value).lower() if isinstance(value, (str, float, int)) else ""
+
+
+class NgramIndex:
+    # substring index over one text column (track_name or artists)
+    # each distinct lowercase string is stored once, and every trigram
+    # points to the sorted ids of the strings that contain it
+    def __init__(self, column, removed=None):
+        # column is a TextColumn, each distinct string is lowercased once and
+        # strings that only differ in case share an id (missing text is last)
+        # removed is a mask of rows to leave out, songs removed by a delta
+        ids = {}
+        lowered = np.array([ids.setdefault(search_text(value), len(ids)) for value in column.values + [np.nan]], dtype=np.int32)
+        row_values = lowered[column.codes]
+        if removed is not None:
+            row_values[removed] = -1
+        values = list(ids)
+
+        # rows of each string id, grouped with one stable sort, removed rows
+        # (id -1) end up before row_bounds[0]
+        row_order = np.argsort(row_values, kind="stable")
+        row_bounds = np.searchsorted(row_values[row_order], np.arange(len(values) + 1))
+
+        postings = {}
+        for value_id, text in enumerate(values):
+            padded = text + PADDING
+            for gram in {padded[i:i + GRAM_SIZE] for i in range(len(text))}:
+                postings.setdefault(gram, []).append(value_id)
+
+        # posting lists packed one after another in gram order
+        grams = sorted(postings)
+        sizes = np.array([len(postings[gram]) for gram in grams], dtype=np.int64)
+        posting_bounds = np.concatenate(([0], np.cumsum(sizes)))
+        posting_ids = np.fromiter((value_id for gram in grams for value_id in postings[gram]), dtype=np.int32, count=int(posting_bounds[-1]))
+
+        self.set_arrays(values, row_order, row_bounds, grams, posting_bounds, posting_ids)
+
+    def set_arrays(self, values, row_order, row_bounds, grams, posting_bounds, posting_ids):
+        self.values = values
+        self.row_count = len(row_order)
+        self.row_order = row_order
+        self.row_bounds = row_bounds
+        self.grams = grams  # sorted, short queries look up every gram starting with them
+        self.gram_positions = {gram: i for i, gram in enumerate(grams)}
+        self.posting_bounds = posting_bounds
+        self.posting_ids = posting_ids
+
+        # rows added or changed after the index was built: row -> lowercase
+        # text, None for removed rows, checked one by one on every search
+        self.overrides = {}
+        self.override_rows = None  # sorted rows of overrides, worked out on the next search
+
+    def set_row(self, row, value):
+        # new text for a row, or None when the song was removed
+        self.overrides[row] = None if value is None else search_text(value)
+        self.override_rows = None
+
+    def needs_rebuild(self):
+        # True once searches spend more time on the overrides than a new build is worth
+        return len(self.overrides) > self.row_count * REBUILD_SHARE
+
+    def to_arrays(self):
+        # everything needed to rebuild the index, for the snapshot
+        return {
+            "values": self.values,
+            "row_order": self.row_order,
+            "row_bounds": self.row_bounds,
+            "grams": self.grams,
+            "posting_bounds": self.posting_bounds,
+            "posting_ids": self.posting_ids,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.set_arrays(**arrays)
+        return index
+
+    def posting(self, position):
+        return self.posting_ids[self.posting_bounds[position]:self.posting_bounds[position + 1]]
+
+    def matching_values(self, query):
+        # ids of the distinct strings that contain query
+        if len(query) < GRAM_SIZE:
+            # every place query shows up is the start of some gram, so the
+            # grams with query as a prefix give exactly the matches
+            lists = []
+            i = bisect_left(self.grams, query)
+            while i < len(self.grams) and self.grams[i].startswith(query):
+                lists.append(self.posting(i))
+                i += 1
+            return np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int32)
+
+        lists = []
+        for gram in {query[i:i + GRAM_SIZE] for i in range(len(query) - GRAM_SIZE + 1)}:
+            if gram not in self.gram_positions:
+                return np.empty(0, dtype=np.int32)
+            lists.append(self.posting(self.gram_positions[gram]))
+
+        # intersect the shortest lists first, then check the few candidates left
+        lists.sort(key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+            if len(candidates) == 0:
+                break
+        return np.array([value_id for value_id in candidates.tolist() if query in self.values[value_id]], dtype=np.int32)
+
+    def search(self, query):
+        # sorted row ids whose text contains query (query already lowercase)
+        rows = self.search_built(query)
+        if not self.overrides:
+            return rows
+        if self.override_rows is None:
+            self.override_rows = np.array(sorted(self.overrides), dtype=np.int64)
+        rows = rows[~np.isin(rows, self.override_rows)]
+        changed = [row for row, text in self.overrides.items() if text is not None and query in text]
+        return np.union1d(rows, np.array(changed, dtype=np.int64))
+
+    def search_built(self, query):
+        # search of the rows as they were when the index was built
+        if not query:
+            if self.row_bounds[0] == 0:
+                return np.arange(self.row_count)
+            return np.sort(self.row_order[self.row_bounds[0]:])  # every row but the removed ones
+        value_ids = self.matching_values(query)
+        if len(value_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = [self.row_order[self.row_bounds[value_id]:self.row_bounds[value_id + 1]] for value_id in value_ids.tolist()]
+        return np.sort(np.concatenate(rows))
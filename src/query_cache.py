@@ -0,0 +1,55 @@
+from collections import OrderedDict
+import threading
+
+
+def query_key(kind, filters):
+    # hashable form of a filter dict, so the same question asked with the
+    # genres in another order (or with empty filters left out) matches
+    # max_songs is left out, playlists are sampled from the cached matches
+    items = []
+    for name, value in sorted(filters.items()):
+        if name == "max_songs" or value is None or (isinstance(value, (list, tuple)) and not value):
+            continue
+        if isinstance(value, list):
+            value = tuple(sorted(set(value)))
+        elif isinstance(value, tuple):
+            value = tuple(float(bound) for bound in value)
+        items.append((name, value))
+    return (kind, tuple(items))
+
+
+class QueryCache:
+    # least recently used cache of query results
+    # each entry keeps the version of the data it was worked out from, and
+    # is thrown away when it is looked up after the data changed
+    # safe to share between threads, e.g. the query server's executor
+    def __init__(self, max_entries=256):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (version, result), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self.entries[key]  # out of date
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, result):
+        with self.lock:
+            self.entries[key] = (version, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def counters(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries)}
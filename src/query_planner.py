@@ -0,0 +1,155 @@
+import numpy as np
+
+# columns filters give a (low, high) band for, each gets a histogram
+HISTOGRAM_COLUMNS = ['danceability', 'valence', 'popularity', 'tempo']
+HISTOGRAM_BINS = 64
+
+# rough cost of each step in microseconds, measured on the 114k song dataset
+# walking a tree runs python code per row, the other steps are numpy passes
+TREE_SEEK_COST = 40.0  # finding where a range starts
+TREE_ROW_COST = 0.3  # each row a tree range gives back
+POSTING_ROW_COST = 0.05  # each row of the genre posting lists
+SCAN_ROW_COST = 0.001  # one predicate over one row of the whole table
+CHECK_ROW_COST = 0.01  # one predicate on one candidate row
+SORT_ROW_COST = 0.1  # putting the matches of a scan in danceability order
+SAMPLE_ROW_COST = 4.0  # drawing one random row of a tree by position and checking it
+
+
+class TableStats:
+    # histograms of the band columns and song counts per genre, worked out at
+    # load and after every delta, used to guess how many rows a filter keeps
+    def __init__(self, table):
+        live = ~table.deleted
+        self.rows = int(live.sum())
+        self.histograms = {}
+        for column in HISTOGRAM_COLUMNS:
+            values = getattr(table, column)[live]
+            if len(values):
+                self.histograms[column] = np.histogram(values, bins=HISTOGRAM_BINS)
+            else:
+                self.histograms[column] = (np.zeros(1, dtype=np.int64), np.array([0.0, 1.0]))
+        self.genre_counts = [len(posting) for posting in table.genre_index.postings]
+        self.genre_lookup = table.genre_lookup
+        self.explicit_rows = int(table.explicit[live].sum())
+
+    def band_fraction(self, column, band):
+        # share of rows with low <= value <= high, values are taken to be
+        # spread evenly inside each bin
+        counts, edges = self.histograms[column]
+        total = counts.sum()
+        if not total:
+            return 0.0
+        low, high = band
+        overlap = np.clip(np.minimum(edges[1:], high) - np.maximum(edges[:-1], low), 0, None)
+        return float((counts * overlap / np.diff(edges)).sum() / total)
+
+    def genre_fraction(self, genres):
+        if not self.rows:
+            return 0.0
+        codes = {code for genre in genres for code in self.genre_lookup.get(genre, [])}
+        return sum(self.genre_counts[code] for code in codes if code < len(self.genre_counts)) / self.rows
+
+    def explicit_fraction(self, explicit):
+        if not self.rows:
+            return 0.0
+        share = self.explicit_rows / self.rows
+        return share if explicit else 1 - share
+
+    def predicates(self, filters):
+        # (filter name, estimated share of rows kept) for every filter in use
+        found = []
+        if filters.get("genres"):
+            found.append(("genres", self.genre_fraction(filters["genres"])))
+        if filters.get("explicit") is not None:
+            found.append(("explicit", self.explicit_fraction(filters["explicit"])))
+        for column in HISTOGRAM_COLUMNS:
+            if filters.get(column):
+                found.append((column, self.band_fraction(column, filters[column])))
+        return found
+
+
+class QueryPlan:
+    # how one filter dict gets answered: an access path giving candidate rows,
+    # then the filters it did not handle, most selective first
+    def __init__(self, access, handled, access_cost, candidates, residual, rows, cost):
+        self.access = access  # "scan", "genre postings", "random sample" or the structure's own lookup
+        self.handled = handled  # filter names the access path already checked
+        self.access_cost = access_cost
+        self.candidates = candidates  # estimated rows the access path gives
+        self.residual = residual  # [(filter name, share kept)] in the order they are checked
+        self.rows = rows  # estimated rows left at the end
+        self.cost = cost
+        self.alternatives = {}  # access path -> estimated cost, for explain
+
+    def explain(self):
+        # the plan as lines of text
+        lines = [f"access: {self.access} (about {self.candidates:.0f} rows, cost {self.access_cost:.0f})"]
+        rows = self.candidates
+        for name, share in self.residual:
+            rows *= share
+            lines.append(f"then check {name}: keeps {share:.1%}, about {rows:.0f} rows")
+        lines.append(f"estimated {self.rows:.0f} matches, total cost {self.cost:.0f}")
+        others = ", ".join(f"{access} {cost:.0f}" for access, cost in self.alternatives.items() if access != self.access)
+        if others:
+            lines.append(f"rejected: {others}")
+        return lines
+
+
+def costed_plan(access, handled, access_cost, candidates, predicates):
+    # plan for an access path, the rest of the filters checked from most to least selective
+    residual = sorted((predicate for predicate in predicates if predicate[0] not in handled), key=lambda predicate: predicate[1])
+    rows = candidates
+    cost = access_cost
+    for _, share in residual:
+        cost += rows * CHECK_ROW_COST
+        rows *= share
+    return QueryPlan(access, handled, access_cost, candidates, residual, rows, cost)
+
+
+def sampling_plan(max_songs, matches, band_rows, handled):
+    # plan for drawing random rows of the tree's danceability band until
+    # max_songs of them pass every filter, about band_rows / matches draws per
+    # song kept, None when too few rows pass for drawing to find enough
+    if matches <= 0:
+        return None
+    draws = max_songs / (matches / band_rows)
+    if draws * 4 > band_rows:
+        return None
+    cost = TREE_SEEK_COST + draws * SAMPLE_ROW_COST
+    return QueryPlan("random sample", handled, cost, draws, [], max_songs, cost)
+
+
+def plan_query(stats, filters, tree_path=None, tree_only=False, band_rows=None):
+    # cheapest way to answer filters
+    # tree_path is (name, filter names its range lookup handles) for the
+    # structure being asked, tree_only when it has no other way in
+    # band_rows is how many rows the tree holds in the danceability band,
+    # given when it can draw random rows from it for a playlist
+    predicates = stats.predicates(filters)
+    shares = dict(predicates)
+    matches = stats.rows * float(np.prod([share for _, share in predicates]))
+    plans = []
+
+    if tree_path is not None:
+        access, handled = tree_path
+        used = [name for name, _ in predicates if name in handled]
+        if used or tree_only:
+            candidates = stats.rows * float(np.prod([shares[name] for name in used]))
+            plans.append(costed_plan(access, set(handled), TREE_SEEK_COST + candidates * TREE_ROW_COST, candidates, predicates))
+
+    if not tree_only:
+        if "genres" in shares:
+            candidates = stats.rows * shares["genres"]
+            plans.append(costed_plan("genre postings", {"genres"}, candidates * POSTING_ROW_COST, candidates, predicates))
+        # every filter as one mask over the whole table
+        scan_cost = stats.rows * SCAN_ROW_COST * (len(predicates) + 1) + matches * SORT_ROW_COST
+        plans.append(costed_plan("scan", set(shares), scan_cost, matches, predicates))
+
+    if band_rows and filters.get("max_songs"):
+        plan = sampling_plan(filters["max_songs"], matches, band_rows, set(shares))
+        if plan is not None:
+            plans.append(plan)
+
+    best = min(plans, key=lambda plan: plan.cost)
+    best.alternatives = {plan.access: plan.cost for plan in plans}
+    return best
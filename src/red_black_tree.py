@@ -1,4 +1,9 @@
+import random
+
+
 class RedBlackTreeNode:
+    __slots__ = ("key", "value", "color", "left", "right", "parent", "size")  # no __dict__ per node
+
     def __init__(self, key, value, color):
         self.key = key
         self.value = value
@@ -6,11 +11,132 @@ class RedBlackTreeNode:
         self.left = None
         self.right = None
         self.parent = None
+        self.size = 1  # nodes in the subtree under this one, itself included
+
+
+# events counted once stats are turned on with enable_stats
+STAT_EVENTS = ("inserts", "deletes", "rotations", "nodes_visited", "key_comparisons")
+
+
+def subtree_size(node):
+    return node.size if node is not None else 0
+
+
+class RedBlackTreeCursor:
+    # position between two entries of a RedBlackTree, moved without recursion
+    # the parent pointers give the next and previous node, so no stack is needed
+    def __init__(self, tree):
+        self.tree = tree
+        self.node = tree.minimum(tree.root)  # entry right after the position, None at the end
+
+    def seek(self, key, inclusive=True):
+        # move to just before the first entry with key >= key (key > key if not inclusive)
+        node = self.tree.root
+        self.node = None
+        visited = 0
+        while node is not None:
+            visited += 1
+            if node.key > key or (inclusive and node.key == key):
+                self.node = node
+                node = node.left
+            else:
+                node = node.right
+        if self.tree.counters is not None:
+            self.tree.count_visits(visited)
+        return self
+
+    def seek_end(self):
+        # move past the last entry, prev then walks backwards from the end
+        self.node = None
+        return self
+
+    def next(self):
+        # (key, value) after the position and step over it, None at the end
+        node = self.node
+        if node is None:
+            return None
+        if node.right is not None:
+            successor = node.right
+            while successor.left is not None:
+                successor = successor.left
+        else:
+            child, successor = node, node.parent
+            while successor is not None and child is successor.right:
+                child, successor = successor, successor.parent
+        self.node = successor
+        return node.key, node.value
+
+    def prev(self):
+        # (key, value) before the position and step back over it, None at the start
+        node = self.node
+        if node is None:
+            if self.tree is None:
+                return None
+            predecessor = self.tree.maximum(self.tree.root)
+        elif node.left is not None:
+            predecessor = node.left
+            while predecessor.right is not None:
+                predecessor = predecessor.right
+        else:
+            child, predecessor = node, node.parent
+            while predecessor is not None and child is predecessor.left:
+                child, predecessor = predecessor, predecessor.parent
+        if predecessor is None:
+            return None
+        self.node = predecessor
+        return predecessor.key, predecessor.value
+
+    def close(self):
+        # drop the references into the tree, next and prev give None after this
+        self.tree = None
+        self.node = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class RedBlackTree:
     def __init__(self):
         self.root = None
+        self.version = 0  # goes up on every insert and delete, for cached results
+        self.counters = None  # event counts, only kept after enable_stats
+
+    @classmethod
+    def from_sorted(cls, items):
+        # build a balanced tree from (key, value) pairs already sorted by key
+        # takes linear time, no comparisons or rotations needed
+        items = items if isinstance(items, list) else list(items)
+        tree = cls()
+        if not items:
+            return tree
+
+        # every level but the last is full, the nodes on an incomplete last
+        # level are red so each path has the same number of black nodes
+        n = len(items)
+        red_depth = n.bit_length() - 1 if n & (n + 1) else -1
+
+        def build(lo, hi, depth, parent):
+            if lo > hi:
+                return None
+            mid = (lo + hi + 1) // 2
+            key, value = items[mid]
+            node = RedBlackTreeNode(key, value, depth == red_depth)
+            node.parent = parent
+            node.left = build(lo, mid - 1, depth + 1, node)
+            node.right = build(mid + 1, hi, depth + 1, node)
+            node.size = hi - lo + 1
+            return node
+
+        tree.root = build(0, n - 1, 0, None)
+        return tree
+
+    @classmethod
+    def bulk_load(cls, iterable):
+        # sort the (key, value) pairs once, then build bottom up
+        return cls.from_sorted(sorted(iterable, key=lambda item: item[0]))
 
     def in_order_traversal(self, node):
         if node is not None:
@@ -18,11 +144,48 @@ class RedBlackTree:
             yield node.value
             yield from self.in_order_traversal(node.right)
 
+    def minimum(self, node):
+        while node is not None and node.left is not None:
+            node = node.left
+        return node
+
+    def maximum(self, node):
+        while node is not None and node.right is not None:
+            node = node.right
+        return node
+
+    def cursor(self):
+        # cursor before the first entry, use seek to start somewhere else
+        return RedBlackTreeCursor(self)
+
     def __iter__(self):
-        return self.in_order_traversal(self.root)
+        cursor = self.cursor()
+        item = cursor.next()
+        while item is not None:
+            yield item[1]
+            item = cursor.next()
+
+    def __reversed__(self):
+        cursor = self.cursor().seek_end()
+        item = cursor.prev()
+        while item is not None:
+            yield item[1]
+            item = cursor.prev()
+
+    def range(self, lo, hi, inclusive=True):
+        # yield values with lo <= key <= hi (or lo < key < hi if not inclusive)
+        # seeks straight to the lower bound and stops after the upper bound
+        cursor = self.cursor().seek(lo, inclusive)
+        item = cursor.next()
+        while item is not None and (item[0] < hi or (inclusive and item[0] == hi)):
+            yield item[1]
+            item = cursor.next()
 
 # insert new node
     def insert(self, key, value):
+        self.version += 1
+        if self.counters is not None:
+            self.counters["inserts"] += 1
         new_node = RedBlackTreeNode(key, value, True)  # new is red
         if self.root is None:
             self.root = new_node
@@ -32,12 +195,17 @@ class RedBlackTree:
         # BST insertion
         parent = None
         current = self.root
+        visited = 0
         while current is not None:
+            visited += 1
             parent = current
+            current.size += 1  # the new node ends up under every node passed
             if key < current.key:
                 current = current.left
             else:
                 current = current.right
+        if self.counters is not None:
+            self.count_visits(visited)
 
         if key < parent.key:
             parent.left = new_node
@@ -86,7 +254,144 @@ class RedBlackTree:
 
 
 
+    def find_node(self, key, value):
+        # node holding exactly this key and value, None if there is none
+        # equal keys sit next to each other in order, so walk through them
+        cursor = self.cursor().seek(key)
+        node = cursor.node
+        while node is not None and node.key == key:
+            if node.value == value:
+                return node
+            cursor.next()
+            node = cursor.node
+        return None
+
+    def delete(self, key, value):
+        # remove the entry with this key and value (e.g. a song's row id)
+        # returns False when it is not in the tree
+        node = self.find_node(key, value)
+        if node is None:
+            return False
+        self.version += 1
+        if self.counters is not None:
+            self.counters["deletes"] += 1
+        self.delete_node(node)
+        return True
+
+    def update(self, key, value, new_key):
+        # move an entry to a new key, e.g. when a song's danceability changes
+        if not self.delete(key, value):
+            return False
+        self.insert(new_key, value)
+        return True
+
+    def transplant(self, node, replacement):
+        # put replacement where node was under node's parent
+        if node.parent is None:
+            self.root = replacement
+        elif node is node.parent.left:
+            node.parent.left = replacement
+        else:
+            node.parent.right = replacement
+        if replacement is not None:
+            replacement.parent = node.parent
+
+    def delete_node(self, node):
+        removed_color = node.color
+        # one node less under everything above the spot that is taken out
+        # (node itself, or its successor when it has two children)
+        removed = node if node.left is None or node.right is None else self.minimum(node.right)
+        ancestor = removed.parent
+        while ancestor is not None:
+            ancestor.size -= 1
+            ancestor = ancestor.parent
+
+        if node.left is None:
+            child, child_parent = node.right, node.parent
+            self.transplant(node, node.right)
+        elif node.right is None:
+            child, child_parent = node.left, node.parent
+            self.transplant(node, node.left)
+        else:
+            # two children, the successor takes node's place
+            successor = self.minimum(node.right)
+            removed_color = successor.color
+            child = successor.right
+            if successor.parent is node:
+                child_parent = successor
+            else:
+                child_parent = successor.parent
+                self.transplant(successor, successor.right)
+                successor.right = node.right
+                successor.right.parent = successor
+            self.transplant(node, successor)
+            successor.left = node.left
+            successor.left.parent = successor
+            successor.color = node.color
+            successor.size = node.size
+
+        # taking out a black node leaves one path short a black node
+        if not removed_color:
+            self.fix_delete(child, child_parent)
+
+    def fix_delete(self, node, parent):
+        # fix after delete, node may be None (an empty leaf counts as black)
+        def is_red(n):
+            return n is not None and n.color
+
+        while node is not self.root and not is_red(node):
+            if node is parent.left:
+                sibling = parent.right
+                if is_red(sibling):
+                    # red sibling
+                    sibling.color = False
+                    parent.color = True
+                    self.left_rotate(parent)
+                    sibling = parent.right
+                if not is_red(sibling.left) and not is_red(sibling.right):
+                    # black sibling with black children
+                    sibling.color = True
+                    node, parent = parent, parent.parent
+                else:
+                    if not is_red(sibling.right):
+                        # far child black, near child red
+                        sibling.left.color = False
+                        sibling.color = True
+                        self.right_rotate(sibling)
+                        sibling = parent.right
+                    # far child red
+                    sibling.color = parent.color
+                    parent.color = False
+                    sibling.right.color = False
+                    self.left_rotate(parent)
+                    node, parent = self.root, None
+            else:
+                sibling = parent.left
+                if is_red(sibling):
+                    sibling.color = False
+                    parent.color = True
+                    self.right_rotate(parent)
+                    sibling = parent.left
+                if not is_red(sibling.left) and not is_red(sibling.right):
+                    sibling.color = True
+                    node, parent = parent, parent.parent
+                else:
+                    if not is_red(sibling.left):
+                        sibling.right.color = False
+                        sibling.color = True
+                        self.left_rotate(sibling)
+                        sibling = parent.left
+                    sibling.color = parent.color
+                    parent.color = False
+                    sibling.left.color = False
+                    self.right_rotate(parent)
+                    node, parent = self.root, None
+        if node is not None:
+            node.color = False
+
     def left_rotate(self, node):
+        if self.counters is not None:
+            self.counters["rotations"] += 1
         right_child = node.right
         node.right = right_child.left
         if right_child.left:
@@ -100,9 +405,13 @@ class RedBlackTree:
             node.parent.right = right_child
         right_child.left = node
         node.parent = right_child
+        right_child.size = node.size
+        node.size = subtree_size(node.left) + subtree_size(node.right) + 1
 
 
     def right_rotate(self, node):
+        if self.counters is not None:
+            self.counters["rotations"] += 1
         left_child = node.left
         node.left = left_child.right
         if left_child.right:
@@ -116,8 +425,107 @@ class RedBlackTree:
             node.parent.left = left_child
         left_child.right = node
         node.parent = left_child
+        left_child.size = node.size
+        node.size = subtree_size(node.left) + subtree_size(node.right) + 1
+
+
+
+    def __len__(self):
+        return subtree_size(self.root)
+
+    def enable_stats(self):
+        # start counting STAT_EVENTS from zero, costs one check per operation while off
+        self.counters = dict.fromkeys(STAT_EVENTS, 0)
+
+    def disable_stats(self):
+        self.counters = None
+
+    def count_visits(self, visited):
+        # one key comparison is made at each node passed on the way down
+        self.counters["nodes_visited"] += visited
+        self.counters["key_comparisons"] += visited
+
+    def height(self):
+        # longest path from the root to a leaf, in nodes
+        height = 0
+        stack = [(self.root, 1)] if self.root is not None else []
+        while stack:
+            node, depth = stack.pop()
+            height = max(height, depth)
+            if node.left is not None:
+                stack.append((node.left, depth + 1))
+            if node.right is not None:
+                stack.append((node.right, depth + 1))
+        return height
 
+    def stats(self):
+        # size and shape of the tree, plus the event counts when they are on
+        size = len(self)
+        shape = {"size": size, "height": self.height(), "best_height": size.bit_length()}
+        return {**shape, **(self.counters or {})}
 
+    def count_below(self, key, or_equal=False):
+        # how many keys are < key (<= key if or_equal), one walk down using the sizes
+        count = 0
+        visited = 0
+        node = self.root
+        while node is not None:
+            visited += 1
+            if node.key < key or (or_equal and node.key == key):
+                count += subtree_size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        if self.counters is not None:
+            self.count_visits(visited)
+        return count
+
+    def count_range(self, lo, hi, inclusive=True):
+        # how many keys range(lo, hi, inclusive) would give, without walking them
+        return max(0, self.count_below(hi, inclusive) - self.count_below(lo, not inclusive))
+
+    def select(self, i):
+        # (key, value) of the i-th entry in key order, counting from 0
+        if not 0 <= i < len(self):
+            raise IndexError("tree index out of range")
+        node = self.root
+        while True:
+            if self.counters is not None:
+                self.counters["nodes_visited"] += 1
+            left_size = subtree_size(node.left)
+            if i < left_size:
+                node = node.left
+            elif i == left_size:
+                return node.key, node.value
+            else:
+                i -= left_size + 1
+                node = node.right
+
+    def sample_range(self, lo, hi, k, inclusive=True):
+        # values of k different entries picked at random from range(lo, hi)
+        # (all of them if there are fewer), one select each
+        start = self.count_below(lo, not inclusive)
+        count = self.count_range(lo, hi, inclusive)
+        return [self.select(i)[1] for i in random.sample(range(start, start + count), min(k, count))]
+
+    def find_k_closest(self, key, k):
+        # values of the k entries with keys closest to key, closest first
+        # one seek to where key would go, then two cursors walk outwards and
+        # the nearer of the next smaller and next larger entry is taken each
+        # step (the smaller one on a tie), so O(log n + k)
+        after = self.cursor().seek(key)
+        before = self.cursor().seek(key)
+        below = before.prev()
+        above = after.next()
+        found = []
+        while len(found) < k and (below is not None or above is not None):
+            if above is None or (below is not None and key - below[0] <= above[0] - key):
+                found.append(below[1])
+                below = before.prev()
+            else:
+                found.append(above[1])
+                above = after.next()
+        return found
 
     def find_closest(self, key):
         # find node with closest key in red - black tree
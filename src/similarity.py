@@ -0,0 +1,101 @@
+import numpy as np
+from src.kd_tree import KDTree, column_points, column_scale
+
+# features two songs are compared on
+SIMILARITY_COLUMNS = ['danceability', 'valence', 'tempo', 'popularity']
+
+# below this many allowed songs, checking them all beats the tree
+BRUTE_FORCE_ROWS = 4096
+
+
+class SimilarityIndex:
+    # "more like this song": the k songs nearest to a seed song or a feature
+    # vector, with every feature scaled to 0 - 1 by its range in the table
+    # answers with a vectorized scan over all songs, or with a k-d tree over
+    # the same scaled features, built on the first tree query
+    def __init__(self, table):
+        self.table = table
+        self.invalidate()
+
+    def invalidate(self):
+        # forget the features and tree, e.g. after songs were added or changed
+        self.points = None
+        self.scale = None
+        self.tree = None
+
+    def features(self):
+        if self.points is None:
+            self.points = column_points(self.table, SIMILARITY_COLUMNS)
+            self.scale = column_scale(self.points)
+        return self.points
+
+    def seed_point(self, seed):
+        # a row id, or a dict of feature values (missing ones use the middle of the range)
+        points = self.features()
+        if isinstance(seed, dict):
+            middle = (points.min(axis=0) + points.max(axis=0)) / 2 if len(points) else np.zeros(len(SIMILARITY_COLUMNS))
+            return np.array([seed.get(column, middle[i]) for i, column in enumerate(SIMILARITY_COLUMNS)], dtype=np.float64)
+        return points[seed]
+
+    def allowed_mask(self, seed, genres=None, explicit=None):
+        # songs that can be recommended: not removed, in one of the genres,
+        # explicit filter passed, and not the seed row itself
+        table = self.table
+        mask = ~table.deleted
+        if genres:
+            mask &= table.genre_index.mask_for(genres)
+        if explicit is not None:
+            mask &= table.explicit == explicit
+        if not isinstance(seed, dict):
+            mask[seed] = False
+        return mask
+
+    def nearest_brute(self, point, k, mask):
+        # distance to every allowed song at once, then the k smallest
+        rows = np.flatnonzero(mask)
+        difference = (self.features()[rows] - point) / self.scale
+        distances = np.einsum("ij,ij->i", difference, difference)
+        if len(rows) > k:
+            keep = np.argpartition(distances, k - 1)[:k]
+            rows, distances = rows[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return rows[order], distances[order]
+
+    def kd_tree(self):
+        # the k-d tree over the scaled features, built on first use
+        if self.tree is None:
+            self.features()
+            self.tree = KDTree(self.table, columns=SIMILARITY_COLUMNS)
+        return self.tree
+
+    def nearest_tree(self, point, k, mask):
+        return self.kd_tree().nearest(point, k, mask)
+
+    def similar_songs(self, seed, k=20, genres=None, explicit=None, method="auto"):
+        # the k songs closest to seed as (row ids, distances), nearest first
+        # a song listed under several genres only shows up once, and copies
+        # of the seed song under other genres are left out
+        # method is "brute", "tree", or "auto" to brute force small sets only
+        point = self.seed_point(seed)
+        mask = self.allowed_mask(seed, genres, explicit)
+        if method == "auto":
+            method = "brute" if genres and mask.sum() <= BRUTE_FORCE_ROWS else "tree"
+        search = self.nearest_brute if method == "brute" else self.nearest_tree
+
+        # ask for a few extra and drop repeats, more if there were many
+        table = self.table
+        wanted = k * 2
+        while True:
+            rows, distances = search(point, wanted, mask)
+            seen_songs = set()
+            if not isinstance(seed, dict):
+                seen_songs.add(int(table.song_ids[seed]))
+            keep = []
+            for i, song_id in enumerate(table.song_ids[rows].tolist()):
+                if song_id not in seen_songs:
+                    seen_songs.add(song_id)
+                    keep.append(i)
+            if len(keep) >= k or len(rows) < wanted:
+                keep = keep[:k]
+                return rows[keep], distances[keep]
+            wanted *= 4
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# bump when the layout of the snapshot changes, old snapshots get rebuilt
+SNAPSHOT_FORMAT = 2
+
+
+def snapshot_path(filepath):
+    # the snapshot is a folder of .npy files next to the csv
+    return filepath + ".snapshot"
+
+
+def source_stamp(filepath):
+    # size and modified time of the csv, a change in either makes the snapshot stale
+    info = os.stat(filepath)
+    return {"size": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+
+def encode_strings(strings):
+    # list of strings -> utf-8 bytes of all of them joined by a separator that
+    # none of them contain, splitting is much faster than slicing at offsets
+    separator = next(chr(code) for code in range(0xE000, 0xF900) if all(chr(code) not in string for string in strings))
+    chars = np.frombuffer(separator.join(strings).encode("utf-8"), dtype=np.uint8)
+    return chars, np.array([ord(separator), len(strings)], dtype=np.int64)
+
+
+def decode_strings(chars, header):
+    separator, count = header.tolist()
+    if count == 0:
+        return []
+    return chars.tobytes().decode("utf-8").split(chr(separator))
+
+
+def flatten(entries, prefix=""):
+    # nested dicts -> {"a.b.c": value}
+    flat = {}
+    for name, value in entries.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + name + "."))
+        else:
+            flat[prefix + name] = value
+    return flat
+
+
+def unflatten(flat):
+    entries = {}
+    for name, value in flat.items():
+        parts = name.split(".")
+        target = entries
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return entries
+
+
+def save_snapshot(filepath, entries):
+    # write nested dicts of arrays (and lists of strings) for the csv at filepath
+    # written to a temp folder first so a crash never leaves half a snapshot
+    path = snapshot_path(filepath)
+    temp_path = path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    arrays = []
+    strings = []
+    for name, value in flatten(entries).items():
+        if isinstance(value, list):
+            chars, header = encode_strings(value)
+            np.save(os.path.join(temp_path, name + ".chars.npy"), chars)
+            np.save(os.path.join(temp_path, name + ".header.npy"), header)
+            strings.append(name)
+        else:
+            np.save(os.path.join(temp_path, name + ".npy"), np.ascontiguousarray(value))
+            arrays.append(name)
+
+    meta = {"format": SNAPSHOT_FORMAT, "source": source_stamp(filepath), "arrays": arrays, "strings": strings}
+    with open(os.path.join(temp_path, "meta.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(filepath):
+    # nested dicts saved by save_snapshot, or None when there is no snapshot
+    # or the csv changed since it was written
+    # arrays are memory mapped read only, so processes on one host share the pages
+    path = snapshot_path(filepath)
+    try:
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["format"] != SNAPSHOT_FORMAT or meta["source"] != source_stamp(filepath):
+            return None
+
+        flat = {}
+        for name in meta["arrays"]:
+            flat[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        for name in meta["strings"]:
+            chars = np.load(os.path.join(path, name + ".chars.npy"), mmap_mode="r")
+            header = np.load(os.path.join(path, name + ".header.npy"))
+            flat[name] = decode_strings(chars, header)
+    except (OSError, ValueError, KeyError):
+        return None
+    return unflatten(flat)
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class TextColumn:
+    # a text column stored dictionary encoded: one int32 code per row into a
+    # list of the distinct strings, so each string is kept once however many
+    # songs share it, and two rows hold the same text exactly when their codes match
+    # code -1 is a missing value, read back as nan like read_csv gives it
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = list(values)
+        self.positions = None  # string -> code, made when the first string is added
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        return self.values[code] if code >= 0 else np.nan
+
+    def __iter__(self):
+        for code in self.codes.tolist():
+            yield self.values[code] if code >= 0 else np.nan
+
+    def code_for(self, value):
+        # code of a string, one not seen before is added to the end
+        if not isinstance(value, str):
+            return -1
+        if self.positions is None:
+            self.positions = {string: code for code, string in enumerate(self.values)}
+        code = self.positions.get(value)
+        if code is None:
+            code = self.positions[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def set(self, row, value):
+        self.codes[row] = self.code_for(value)
+
+    def append(self, values):
+        added = np.array([self.code_for(value) for value in values], dtype=self.codes.dtype)
+        self.codes = np.concatenate((self.codes, added))
+
+    def make_writable(self):
+        # codes memory mapped from a snapshot are read only
+        if not self.codes.flags.writeable:
+            self.codes = np.array(self.codes)